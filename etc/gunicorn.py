@@ -5,3 +5,10 @@ import multiprocessing
 bind = '127.0.0.1:1234'
 
 workers = multiprocessing.cpu_count() * 2 + 1
+
+
+def worker_exit(server, worker):
+    '''worker 进程退出时，把缓冲区中用户最近操作时间写入数据库'''
+    app = worker.wsgi
+    if 'last_seen' in getattr(app, 'extensions', {}):
+        app.extensions['last_seen'].flush()
@@ -0,0 +1,32 @@
+"""add indexes for cursor pagination
+
+Revision ID: 1039de8470fb
+Revises: d7b6c4b28e87
+Create Date: 2026-10-18 10:03:47.518230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1039de8470fb'
+down_revision = 'd7b6c4b28e87'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_blog_time_stamp'), 'blog', ['time_stamp'], unique=False)
+    op.create_index('ix_blog_author_id_time_stamp', 'blog', ['author_id', 'time_stamp'], unique=False)
+    op.create_index('ix_comment_blog_id_time_stamp', 'comment', ['blog_id', 'time_stamp'], unique=False)
+    op.create_index('ix_follows_follower_id_time_stamp', 'follows', ['follower_id', 'time_stamp'], unique=False)
+    op.create_index('ix_follows_followed_id_time_stamp', 'follows', ['followed_id', 'time_stamp'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_follows_followed_id_time_stamp', table_name='follows')
+    op.drop_index('ix_follows_follower_id_time_stamp', table_name='follows')
+    op.drop_index('ix_comment_blog_id_time_stamp', table_name='comment')
+    op.drop_index('ix_blog_author_id_time_stamp', table_name='blog')
+    op.drop_index(op.f('ix_blog_time_stamp'), table_name='blog')
@@ -0,0 +1,28 @@
+"""add fulltext index on blog.body for the mysql search backend
+
+Revision ID: 395068cd36af
+Revises: d390e3553afc
+Create Date: 2026-10-18 17:40:55.120397
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '395068cd36af'
+down_revision = 'd390e3553afc'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 只有 MySQL 支持 ngram 分词的 FULLTEXT 索引，其它数据库跳过
+    if op.get_bind().dialect.name == 'mysql':
+        op.execute('CREATE FULLTEXT INDEX ft_blog_body ON blog (body) '
+                'WITH PARSER ngram')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'mysql':
+        op.drop_index('ft_blog_body', table_name='blog')
@@ -0,0 +1,40 @@
+"""add comment.updated_at, follows time_stamp index and tombstone table
+
+Revision ID: 3fcce96b8f50
+Revises: 395068cd36af
+Create Date: 2026-10-18 21:42:37.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3fcce96b8f50'
+down_revision = '395068cd36af'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('comment', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    # 已有评论的修改时间取发表时间
+    op.execute('UPDATE comment SET updated_at = time_stamp')
+    op.create_index(op.f('ix_comment_updated_at'), 'comment', ['updated_at'], unique=False)
+    op.create_index(op.f('ix_follows_time_stamp'), 'follows', ['time_stamp'], unique=False)
+    op.create_table('tombstone',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=16), nullable=False),
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_tombstone_deleted_at'), 'tombstone', ['deleted_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_tombstone_deleted_at'), table_name='tombstone')
+    op.drop_table('tombstone')
+    op.drop_index(op.f('ix_follows_time_stamp'), table_name='follows')
+    op.drop_index(op.f('ix_comment_updated_at'), table_name='comment')
+    op.drop_column('comment', 'updated_at')
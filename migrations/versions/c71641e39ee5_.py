@@ -0,0 +1,40 @@
+"""add counter columns to user and blog
+
+Revision ID: c71641e39ee5
+Revises: 1039de8470fb
+Create Date: 2026-10-18 11:20:05.937441
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c71641e39ee5'
+down_revision = '1039de8470fb'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('blog', sa.Column('comments_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('user', sa.Column('blogs_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('user', sa.Column('followed_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('user', sa.Column('followers_count', sa.Integer(), server_default='0', nullable=False))
+    # 根据已有数据初始化计数器，与 flask reconcile-counters 命令相同
+    op.execute('UPDATE user SET '
+            'blogs_count = (SELECT COUNT(*) FROM blog '
+            'WHERE blog.author_id = user.id), '
+            'followers_count = (SELECT COUNT(*) FROM follows '
+            'WHERE follows.followed_id = user.id), '
+            'followed_count = (SELECT COUNT(*) FROM follows '
+            'WHERE follows.follower_id = user.id)')
+    op.execute('UPDATE blog SET comments_count = (SELECT COUNT(*) '
+            'FROM comment WHERE comment.blog_id = blog.id)')
+
+
+def downgrade():
+    op.drop_column('user', 'followers_count')
+    op.drop_column('user', 'followed_count')
+    op.drop_column('user', 'blogs_count')
+    op.drop_column('blog', 'comments_count')
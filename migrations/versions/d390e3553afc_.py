@@ -0,0 +1,28 @@
+"""add blog.updated_at
+
+Revision ID: d390e3553afc
+Revises: f04a1054cde4
+Create Date: 2026-10-18 16:25:12.804113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd390e3553afc'
+down_revision = 'f04a1054cde4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('blog', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    # 已有博客的修改时间取发布时间
+    op.execute('UPDATE blog SET updated_at = time_stamp')
+    op.create_index(op.f('ix_blog_updated_at'), 'blog', ['updated_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_blog_updated_at'), table_name='blog')
+    op.drop_column('blog', 'updated_at')
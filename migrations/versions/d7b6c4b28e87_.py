@@ -0,0 +1,38 @@
+"""add timeline table
+
+Revision ID: d7b6c4b28e87
+Revises: 0eef1f7fc80a
+Create Date: 2026-10-18 09:12:31.402115
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7b6c4b28e87'
+down_revision = '0eef1f7fc80a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('timeline',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('blog_id', sa.Integer(), nullable=False),
+    sa.Column('author_id', sa.Integer(), nullable=True),
+    sa.Column('time_stamp', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['author_id'], ['user.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['blog_id'], ['blog.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'blog_id')
+    )
+    op.create_index('ix_timeline_user_id_author_id', 'timeline', ['user_id', 'author_id'], unique=False)
+    op.create_index('ix_timeline_user_id_time_stamp', 'timeline', ['user_id', 'time_stamp'], unique=False)
+    # 已有的关注关系需要执行 flask rebuild-timeline 生成时间线
+
+
+def downgrade():
+    op.drop_index('ix_timeline_user_id_time_stamp', table_name='timeline')
+    op.drop_index('ix_timeline_user_id_author_id', table_name='timeline')
+    op.drop_table('timeline')
@@ -0,0 +1,49 @@
+"""store email md5 in user.avatar_hash
+
+Revision ID: f04a1054cde4
+Revises: c71641e39ee5
+Create Date: 2026-10-18 14:02:41.518274
+
+"""
+import hashlib
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f04a1054cde4'
+down_revision = 'c71641e39ee5'
+branch_labels = None
+depends_on = None
+
+# 每批回填的用户数量
+BATCH_SIZE = 1000
+
+user = sa.table('user',
+        sa.column('id', sa.Integer),
+        sa.column('email', sa.String),
+        sa.column('avatar_hash', sa.String))
+
+
+def upgrade():
+    # avatar_hash 原先存的是完整的头像 URL ，改为邮箱的 MD5 散列值
+    # 按 id 分批处理，避免一次把全部用户读进内存
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        rows = conn.execute(sa.select([user.c.id, user.c.email]).where(
+                user.c.id > last_id).order_by(user.c.id).limit(BATCH_SIZE)
+                ).fetchall()
+        if not rows:
+            break
+        params = [{'_id': id, '_hash': hashlib.md5(
+                (email or '').strip().lower().encode()).hexdigest()
+                if email else None} for id, email in rows]
+        conn.execute(user.update().where(user.c.id == sa.bindparam('_id')
+                ).values(avatar_hash=sa.bindparam('_hash')), params)
+        last_id = rows[-1][0]
+
+
+def downgrade():
+    # 旧代码在 avatar_hash 为空时现算头像 URL
+    op.execute(user.update().values(avatar_hash=None))
@@ -0,0 +1,86 @@
+'''
+终端命令行执行
+python3 -m scripts.benchmark_search [博客数量] [后端名称 ...]
+例如：python3 -m scripts.benchmark_search 2000 whoosh mysql
+
+比较各个搜索后端的索引速度和查询延迟
+脚本会用虚拟数据创建博客，测试结束后删除，不要在生产数据库上执行
+mysql 后端需要先执行 flask db upgrade 创建 FULLTEXT 索引
+'''
+
+import sys
+import time
+from faker import Faker
+from manage import app
+
+# 启动应用的上下文环境
+app.app_context().push()
+
+from weblog.models import db, User, Blog
+from weblog.search.backends import BACKENDS
+
+
+fake = Faker('zh-cn')                   # 创建虚拟数据的工具
+QUERIES = 50                            # 每个后端执行的查询次数
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def create_blogs(count):
+    '''创建 count 篇虚拟博客，返回值是 (博客 ID 列表, 耗时)'''
+    author = User.query.first()
+    start = time.perf_counter()
+    blogs = [Blog(author=author, body=fake.text(max_nb_chars=222))
+            for i in range(count)]
+    db.session.add_all(blogs)
+    db.session.commit()
+    return [blog.id for blog in blogs], time.perf_counter() - start
+
+
+def benchmark(name, ids, insert_time):
+    backend = BACKENDS[name](app)
+    table = Blog.__table__
+    rows = db.session.execute(db.select([table.c.id, table.c.body]).where(
+            table.c.id.in_(ids))).fetchall()
+    # Whoosh 需要写入索引，MySQL 的索引在插入数据时已经建好，计入插入的耗时
+    start = time.perf_counter()
+    backend.index(rows)
+    index_time = time.perf_counter() - start
+    if not backend.uses_queue:
+        index_time += insert_time
+    words = [fake.word() for i in range(QUERIES)]
+    latencies = []
+    hits = 0
+    for word in words:
+        start = time.perf_counter()
+        hits += len(backend.search(word, limit=10))
+        latencies.append(time.perf_counter() - start)
+    print('{:8} index {:8.1f} blogs/s   query p50 {:6.1f} ms   '
+            'p95 {:6.1f} ms   avg hits {:.1f}'.format(
+            name, len(ids) / index_time,
+            percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.95) * 1000, hits / QUERIES))
+    return backend
+
+
+def run():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    names = sys.argv[2:] or [app.config['SEARCH_BACKEND']]
+    ids, insert_time = create_blogs(count)
+    print('Inserted {} blogs in {:.1f}s'.format(count, insert_time))
+    try:
+        for name in names:
+            backend = benchmark(name, ids, insert_time)
+            backend.index([], deleted=ids)
+    finally:
+        # 删除虚拟博客，并从 Whoosh 索引中删除
+        Blog.query.filter(Blog.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+    print('OK')
+
+
+if __name__ == '__main__':
+    run()
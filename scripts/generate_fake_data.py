@@ -36,7 +36,6 @@ def iter_users():
                 about_me = fake.sentence(nb_words=15),
                 confirmed = 1
         )
-        user.avatar_hash = user.gravatar()
         yield user
 
     # 创建 1 个管理员用户
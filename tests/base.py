@@ -1,7 +1,9 @@
+from contextlib import contextmanager
 from flask import url_for
 from functools import wraps
+from sqlalchemy import event
 
-from weblog.app import create_app, User
+from weblog.app import create_app, db, User
 
 
 PASSWORD = 'SYL123'
@@ -20,7 +22,28 @@ def login(func):
                 headers={'Content-Type': 'multipart/form-data'})
         return func(*args, **kw)
     return wrapper
-            
+
+
+
+@contextmanager
+def assert_max_queries(count):
+    '''断言 with 语句块中执行的 SQL 语句不超过 count 条
+
+    用于发现模板中逐行查询关联对象（N+1 查询）之类的问题
+    '''
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute',
+                before_cursor_execute)
+    assert len(statements) <= count, '{} queries executed:\n{}'.format(
+            len(statements), '\n'.join(statements))
 
 
 """
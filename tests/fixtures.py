@@ -1,4 +1,6 @@
+import socketserver
 import pytest
+from threading import Thread
 from flask import url_for
 
 from weblog.app import create_app, db, User, Blog, Comment
@@ -12,7 +14,7 @@ def app():
     return app
 
 
-@pytest.yield_fixture
+@pytest.fixture
 def client(app):
     '''客户端'''
 
@@ -53,3 +55,72 @@ def comment(app, blog):
     db.session.add(comment)
     db.session.commit()
     return comment
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    '''只实现发送邮件用到的 SMTP 命令，把收到的邮件保存在 server.messages 中'''
+
+    def reply(self, line):
+        self.wfile.write((line + '\r\n').encode())
+
+    def handle(self):
+        self.reply('220 localhost')
+        rcpttos = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250 localhost')
+            elif verb in ('MAIL', 'RSET'):
+                rcpttos = []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                rcpttos.append(command[command.index('<') + 1:
+                        command.index('>')])
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                while True:
+                    line = self.rfile.readline()
+                    if line in (b'.\r\n', b'.\n', b''):
+                        break
+                    # 以 . 开头的行发送时前面多加了一个 .
+                    lines.append(line[1:] if line.startswith(b'..') else line)
+                self.server.messages.append((rcpttos, b''.join(lines)))
+                rcpttos = []
+                self.reply('250 OK')
+            elif verb == 'NOOP':
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class _SMTPServer(socketserver.ThreadingTCPServer):
+    '''本地的调试 SMTP 服务器'''
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address):
+        super().__init__(address, _SMTPHandler)
+        self.messages = []
+
+
+@pytest.fixture
+def smtp_server(app):
+    '''在 MAIL_SERVER:MAIL_PORT 上运行的调试 SMTP 服务器'''
+
+    server = _SMTPServer((app.config['MAIL_SERVER'], app.config['MAIL_PORT']))
+    thread = Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05})
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
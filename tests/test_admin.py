@@ -34,3 +34,9 @@ class TestAdmin:
         assert resp.status_code == 200
         assert comment.disable == 0
         assert b'<title>Moderate Comments</title>' in resp.data
+
+    @login
+    def test_cache_stats(self, client, admin):
+        resp = client.get(url_for('admin.cache_stats'))
+        assert resp.status_code == 200
+        assert 'hit_rate' in resp.get_json()['pages']
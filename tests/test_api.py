@@ -1,11 +1,18 @@
 import json
 import re
+import time
+import pytest
 from flask import url_for
+from werkzeug.http import http_date
 from flask_login import login_user, current_user
 from base64 import b64encode
+from datetime import datetime, timedelta
 
+from weblog import pagination
+from weblog.export import parse_since
+from weblog.api.lookup import parse_ids
 from weblog.models import db, User, Role, Blog, Comment
-from .base import PASSWORD, login
+from .base import PASSWORD, login, assert_max_queries
 
 
 class TestApi:
@@ -149,3 +156,385 @@ class TestApi:
         comment = Comment.query.get(d['url'].split('/')[-1])
         db.session.delete(comment)
         db.session.commit()
+
+    def test_get_blogs_cursor_pagination(self, client):
+        headers = self.get_api_headers
+        url = url_for('api.get_blogs')
+        ids = []
+        pages = []
+        while url:
+            d = json.loads(client.get(url, headers=headers).data.decode())
+            pages.append(d)
+            ids.extend(b['url'] for b in d['blogs'])
+            url = d['next']
+        assert len(ids) == len(set(ids)) == Blog.query.count()
+        assert pages[0]['prev'] is None
+        if len(pages) > 1:
+            d = json.loads(client.get(pages[1]['prev'],
+                    headers=headers).data.decode())
+            assert d['blogs'] == pages[0]['blogs']
+
+    def test_get_blogs_page_pagination(self, client):
+        resp = client.get(
+                url_for('api.get_blogs', page=2),
+                headers=self.get_api_headers
+        )
+        assert resp.status_code == 200
+        d = json.loads(resp.data.decode())
+        assert d['prev'] == url_for('api.get_blogs', page=1)
+        assert d['next_cursor'] is None
+
+    def test_get_blogs_count_cache(self, client):
+        headers = self.get_api_headers
+        d = json.loads(client.get(url_for('api.get_blogs'),
+                headers=headers).data.decode())
+        assert d['count'] == Blog.query.count()
+        resp = client.post(
+                url_for('api.new_blog'),
+                data=json.dumps({'body': '总数缓存测试'}),
+                headers=headers
+        )
+        id = json.loads(resp.data.decode())['url'].split('/')[-1]
+        blog = Blog.query.get(id)
+        d = json.loads(client.get(url_for('api.get_blogs'),
+                headers=headers).data.decode())
+        assert d['count'] == Blog.query.count()
+        db.session.delete(blog)
+        db.session.commit()
+        d = json.loads(client.get(url_for('api.get_blogs', approx=1),
+                headers=headers).data.decode())
+        assert isinstance(d['count'], int)
+
+    def test_get_blogs_approx_count_page_mode(self, client, monkeypatch):
+        # 页码分页使用近似总数时，不再先执行一次精确的 COUNT
+        calls = []
+        monkeypatch.setattr(pagination, 'cached_count',
+                lambda query: calls.append(query) or 0)
+        monkeypatch.setattr(pagination, 'approximate_count',
+                lambda query: 123)
+        d = json.loads(client.get(url_for('api.get_blogs', page=2, approx=1),
+                headers=self.get_api_headers).data.decode())
+        assert d['count'] == 123
+        assert calls == []
+
+    def test_conditional_get(self, client, blog):
+        url = url_for('api.get_blog', id=blog.id)
+        resp = client.get(url, headers=self.get_api_headers)
+        etag = resp.headers['ETag']
+        assert resp.headers['Last-Modified']
+        headers = dict(self.get_api_headers, **{'If-None-Match': etag})
+        resp = client.get(url, headers=headers)
+        assert resp.status_code == 304
+        assert resp.data == b''
+        # 博客修改之后 ETag 随之改变
+        body = blog.body
+        blog.body = body + ' '
+        db.session.commit()
+        resp = client.get(url, headers=headers)
+        assert resp.status_code == 200
+        assert resp.headers['ETag'] != etag
+        blog.body = body
+        db.session.commit()
+
+    def test_conditional_get_collection(self, client):
+        url = url_for('api.get_blogs')
+        resp = client.get(url, headers=self.get_api_headers)
+        headers = dict(self.get_api_headers,
+                **{'If-None-Match': resp.headers['ETag']})
+        assert client.get(url, headers=headers).status_code == 304
+
+    def test_conditional_get_collection_without_count(self, client,
+            monkeypatch):
+        # 游标分页的 ETag 不需要数据总数，approx=1 时不执行精确的 COUNT
+        calls = []
+        monkeypatch.setattr(pagination, 'cached_count',
+                lambda query: calls.append(query) or 0)
+        monkeypatch.setattr(pagination, 'approximate_count',
+                lambda query: 123)
+        url = url_for('api.get_blogs', approx=1)
+        resp = client.get(url, headers=self.get_api_headers)
+        assert json.loads(resp.data.decode())['count'] == 123
+        headers = dict(self.get_api_headers,
+                **{'If-None-Match': resp.headers['ETag']})
+        assert client.get(url, headers=headers).status_code == 304
+        assert calls == []
+
+    def test_last_modified_is_utc(self, client, blog, monkeypatch):
+        # 服务器在东八区时，Last-Modified 是 8 小时之前的 UTC 时间
+        monkeypatch.setenv('TZ', 'Asia/Shanghai')
+        time.tzset()
+        try:
+            url = url_for('api.get_blog', id=blog.id)
+            resp = client.get(url, headers=self.get_api_headers)
+            assert resp.last_modified == (blog.updated_at - timedelta(
+                    hours=8)).replace(microsecond=0)
+            headers = dict(self.get_api_headers, **{
+                    'If-Modified-Since': resp.headers['Last-Modified']})
+            assert client.get(url, headers=headers).status_code == 304
+            # 客户端的副本早于博客的修改时间，返回完整的响应
+            headers['If-Modified-Since'] = http_date(
+                    resp.last_modified - timedelta(hours=1))
+            assert client.get(url, headers=headers).status_code == 200
+        finally:
+            monkeypatch.undo()
+            time.tzset()
+
+    def test_last_modified_changes_with_comments_count(self, client, blog,
+            user):
+        url = url_for('api.get_blog', id=blog.id)
+        resp = client.get(url, headers=self.get_api_headers)
+        headers = dict(self.get_api_headers,
+                **{'If-Modified-Since': resp.headers['Last-Modified']})
+        # 评论数量变化时博客的修改时间随之改变，只带 If-Modified-Since 也能看到
+        time.sleep(1)
+        comment = Comment(body='修改时间测试', author=user, blog=blog)
+        db.session.add(comment)
+        db.session.commit()
+        resp = client.get(url, headers=headers)
+        assert resp.status_code == 200
+        assert json.loads(resp.data.decode())['comments_count'] == \
+                blog.comments_count
+        db.session.delete(comment)
+        db.session.commit()
+
+    def test_token_auth(self, client, user):
+        resp = client.post(url_for('api.get_token'),
+                headers=self.get_api_headers)
+        assert resp.status_code == 200
+        token = json.loads(resp.data.decode())['token']
+        s = b64encode(f'{token}:'.encode()).decode()
+        headers = {'Authorization': f'Basic {s}',
+                'Accept': 'application/json'}
+        resp = client.get(url_for('api.get_user', id=user.id),
+                headers=headers)
+        assert resp.status_code == 200
+        # 令牌和用户都命中缓存，验证身份不执行查询
+        db.session.remove()
+        with assert_max_queries(1):
+            resp = client.get(url_for('api.get_user', id=user.id),
+                    headers=headers)
+        assert resp.status_code == 200
+        # 令牌不能换取新的令牌
+        resp = client.post(url_for('api.get_token'), headers=headers)
+        assert resp.status_code == 401
+        s = b64encode(f'{token}x:'.encode()).decode()
+        resp = client.get(url_for('api.get_user', id=user.id),
+                headers={'Authorization': f'Basic {s}'})
+        assert resp.status_code == 401
+
+    def test_lookup_by_ids(self, client, user):
+        headers = self.get_api_headers
+        ids = [b.id for b in Blog.query.limit(3)][::-1]
+        with assert_max_queries(3):
+            resp = client.get(url_for('api.get_blogs',
+                    ids=','.join(map(str, ids + [ids[0], 0]))),
+                    headers=headers)
+        assert resp.status_code == 200
+        d = json.loads(resp.data.decode())
+        # 按请求的顺序返回，重复的 ID 只返回一次，不存在的 ID 放在 missing 中
+        assert [b['url'] for b in d['blogs']] == [
+                url_for('api.get_blog', id=id) for id in ids]
+        assert d['missing'] == [0]
+        resp = client.get(url_for('api.get_users', ids=f'{user.id}'),
+                headers=headers)
+        d = json.loads(resp.data.decode())
+        assert d['users'][0]['name'] == user.name
+        resp = client.get(url_for('api.get_comments', ids='a,b'),
+                headers=headers)
+        assert resp.status_code == 400
+        resp = client.get(url_for('api.get_users',
+                ids=','.join(map(str, range(1, 200)))), headers=headers)
+        assert resp.status_code == 400
+        # /api/blogs 不带末尾的斜杠也可以按 ID 批量获取
+        resp = client.get('/api/blogs?ids={}'.format(ids[0]), headers=headers)
+        assert resp.status_code == 200
+        assert json.loads(resp.data.decode())['blogs'][0]['url'] == \
+                url_for('api.get_blog', id=ids[0])
+        assert url_for('api.get_blogs') == '/api/blogs/'
+
+    def test_parse_ids(self):
+        assert parse_ids('3, 1,,3,2') == [3, 1, 2]
+        # 超过上限时只解析到 limit + 1 个不同的 ID
+        assert parse_ids(','.join(['1'] * 1000 + ['2', '3', 'x']), 1) == [1, 2]
+        with pytest.raises(ValueError):
+            parse_ids('1,a')
+
+    def test_batch(self, client, blog):
+        requests = [
+            {'path': url_for('api.get_blog', id=blog.id)},
+            {'path': url_for('api.get_blog_comments', id=blog.id)},
+            {'path': url_for('api.get_user', id=blog.author_id)},
+            {'path': url_for('api.get_blog', id=0)},
+            {'path': url_for('api.batch'), 'method': 'POST'},
+            {'path': url_for('main.index')},
+        ]
+        # 只验证一次身份
+        with assert_max_queries(6):
+            resp = client.post(url_for('api.batch'),
+                    data=json.dumps(requests), headers=self.get_api_headers)
+        assert resp.status_code == 200
+        d = json.loads(resp.data.decode())
+        assert [r['status'] for r in d] == [200, 200, 200, 404, 400, 400]
+        assert d[0]['body']['body'] == blog.body
+        assert 'ETag' in d[0]['headers']
+        assert 'comments' in d[1]['body']
+        assert d[2]['body']['url'] == requests[2]['path']
+        resp = client.post(url_for('api.batch'),
+                data=json.dumps(requests * 4), headers=self.get_api_headers)
+        assert resp.status_code == 400
+
+    def test_batch_invalid_sub_requests(self, client, blog):
+        path = url_for('api.get_blog', id=blog.id)
+        requests = [
+            'not an object',
+            {'method': 'GET'},
+            {'path': path, 'method': 1},
+            {'path': path, 'headers': ['Accept']},
+            {'path': path, 'headers': {'X-Count': 1}},
+            {'path': path, 'method': 'get', 'headers': {'Accept': '*/*'}},
+        ]
+        resp = client.post(url_for('api.batch'),
+                data=json.dumps(requests), headers=self.get_api_headers)
+        assert resp.status_code == 200
+        d = json.loads(resp.data.decode())
+        # 格式不对的子请求各自返回 400 ，不影响其他子请求
+        assert [r['status'] for r in d] == [400, 400, 400, 400, 400, 200]
+        assert d[2]['body']['message'] == 'method must be a string'
+        assert d[3]['body']['message'] == 'headers must be an object of strings'
+
+    def test_export(self, app, client, blog):
+        resp = client.get(url_for('api.export', kind='blogs'),
+                headers=self.get_api_headers)
+        assert resp.status_code == 200
+        assert resp.mimetype == 'application/x-ndjson'
+        lines = resp.data.decode().splitlines()
+        assert len(lines) == Blog.query.count()
+        assert json.loads(lines[0])['url'] == url_for('api.get_blog',
+                id=Blog.query.order_by(Blog.id).first().id)
+        # 增量导出只包含 since 之后修改过的博客
+        since = resp.headers['X-Export-Started-At']
+        blog.body = blog.body + ' '
+        db.session.commit()
+        resp = client.get(url_for('api.export', kind='blogs', since=since),
+                headers=self.get_api_headers)
+        lines = resp.data.decode().splitlines()
+        assert [json.loads(line)['url'] for line in lines] == [
+                url_for('api.get_blog', id=blog.id)]
+        blog.body = blog.body[:-1]
+        db.session.commit()
+        result = app.test_cli_runner().invoke(args=['export', 'users'])
+        assert result.exit_code == 0, result.output
+        assert len(result.output.splitlines()) == User.query.count()
+
+    def test_export_new_users_incrementally(self, client):
+        resp = client.get(url_for('api.export', kind='users'),
+                headers=self.get_api_headers)
+        since = resp.headers['X-Export-Started-At']
+        # 导出之后注册的用户出现在下次增量导出中
+        user = User(name='export_user', email='export_user@example.com',
+                password=PASSWORD)
+        db.session.add(user)
+        db.session.commit()
+        try:
+            resp = client.get(url_for('api.export', kind='users',
+                    since=since), headers=self.get_api_headers)
+            urls = [json.loads(line)['url']
+                    for line in resp.data.decode().splitlines()]
+            assert urls == [url_for('api.get_user', id=user.id)]
+        finally:
+            db.session.delete(user)
+            db.session.commit()
+
+    def test_export_started_at_settles(self, app, client, blog):
+        # 下次增量导出的起点往前留出 CHANGES_SETTLE_SECONDS 秒
+        app.config['CHANGES_SETTLE_SECONDS'] = 60
+        resp = client.get(url_for('api.export', kind='blogs'),
+                headers=self.get_api_headers)
+        before = datetime.now()
+        since = parse_since(resp.headers['X-Export-Started-At'])
+        assert since <= before - timedelta(seconds=60)
+        # 导出开始前刚刚修改的博客会在下次增量导出中再出现一次
+        table = Blog.__table__
+        db.session.execute(table.update().where(table.c.id == blog.id
+                ).values(updated_at=before - timedelta(seconds=30)))
+        db.session.commit()
+        resp = client.get(url_for('api.export', kind='blogs',
+                since=resp.headers['X-Export-Started-At']),
+                headers=self.get_api_headers)
+        urls = [json.loads(line)['url']
+                for line in resp.data.decode().splitlines()]
+        assert url_for('api.get_blog', id=blog.id) in urls
+
+    def test_changes(self, client, user):
+        headers = self.get_api_headers
+
+        def sync(cursor=None):
+            resp = client.get(url_for('api.get_changes', since=cursor),
+                    headers=headers)
+            assert resp.status_code == 200
+            return json.loads(resp.data.decode())
+
+        # 不带游标时从头开始同步，has_more 为 False 时同步完成
+        d = sync()
+        blogs = len(d['blogs'])
+        while d['has_more']:
+            d = sync(d['cursor'])
+            blogs += len(d['blogs'])
+        assert blogs == Blog.query.count()
+        # 任选一个还没有关注的用户，关注之后再取关
+        other = next(u for u in User.query.filter(User.id != user.id
+                ).order_by(User.id) if not user.is_following(u))
+        blog = Blog(body='增量同步测试', author=user)
+        comment = Comment(body='增量同步评论', author=user, blog=blog)
+        db.session.add_all([blog, comment])
+        db.session.commit()
+        user.follow(other)
+        d = sync(d['cursor'])
+        assert [b['url'] for b in d['blogs']] == [
+                url_for('api.get_blog', id=blog.id)]
+        assert [c['body'] for c in d['comments']] == ['增量同步评论']
+        assert d['follows'][0]['followed_url'] == url_for('api.get_user',
+                id=other.id)
+        assert d['deleted'] == []
+        # 删除的数据通过 Tombstone 同步
+        ids = blog.id, comment.id
+        user.unfollow(other)
+        db.session.delete(blog)
+        db.session.commit()
+        d = sync(d['cursor'])
+        assert d['blogs'] == d['comments'] == d['follows'] == []
+        assert sorted(t['kind'] for t in d['deleted']) == [
+                'blog', 'comment', 'follow']
+        assert {t.get('url') for t in d['deleted']} >= {
+                url_for('api.get_blog', id=ids[0]),
+                url_for('api.get_comment', id=ids[1])}
+        assert sync(d['cursor'])['deleted'] == []
+        resp = client.get(url_for('api.get_changes', since='bad'),
+                headers=headers)
+        assert resp.status_code == 400
+
+    def test_changes_comments_count(self, client, user, blog):
+        headers = self.get_api_headers
+
+        def sync(cursor=None):
+            resp = client.get(url_for('api.get_changes', since=cursor),
+                    headers=headers)
+            assert resp.status_code == 200
+            return json.loads(resp.data.decode())
+
+        d = sync()
+        while d['has_more']:
+            d = sync(d['cursor'])
+        # 新评论改变了博客的评论数量，博客也出现在增量同步的结果中
+        comment = Comment(body='评论数量同步测试', author=user, blog=blog)
+        db.session.add(comment)
+        db.session.commit()
+        try:
+            d = sync(d['cursor'])
+            blogs = {b['url']: b for b in d['blogs']}
+            url = url_for('api.get_blog', id=blog.id)
+            assert url in blogs
+            assert blogs[url]['comments_count'] == blog.comments_count
+        finally:
+            db.session.delete(comment)
+            db.session.commit()
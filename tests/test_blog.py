@@ -1,6 +1,6 @@
 from flask import url_for
 
-from .base import login
+from .base import login, assert_max_queries
 from weblog.models import db, Comment
 
 
@@ -13,6 +13,19 @@ class TestBlog:
         assert resp.status_code == 200
         assert blog.body in resp.data.decode()
 
+    def test_index_query_count(self, client, blog, comment):
+        db.session.expunge_all()
+        # 博客、评论和它们的作者一共两条查询
+        with assert_max_queries(2):
+            resp = client.get(url_for('blog.index', id=blog.id))
+        assert resp.status_code == 200
+
+    def test_index_conditional_get(self, client, blog):
+        url = url_for('blog.index', id=blog.id)
+        etag = client.get(url).headers['ETag']
+        resp = client.get(url, headers={'If-None-Match': etag})
+        assert resp.status_code == 304
+
     @login
     def test_index_post(self, client, user, blog, comment):
         data = {'body': comment.body}
@@ -1,7 +1,10 @@
+from datetime import timedelta
 from flask import url_for
 
-from weblog.models import db, User
-from .base import PASSWORD, login
+from weblog.models import db, User, Blog
+from weblog.fragments import fragment_cache, fragment_key
+from weblog.page_cache import response_cache
+from .base import PASSWORD, login, assert_max_queries
 
 
 class TestMain:
@@ -45,6 +48,84 @@ class TestMain:
         assert resp.status_code == 200
         assert '记录你的想法'.encode() in resp.data
 
+    def test_index_fragment_cache(self, client):
+        client.get(url_for('main.index'))
+        blog = Blog.query.order_by(Blog.time_stamp.desc(), Blog.id.desc()
+                ).first()
+        key = fragment_key(blog)
+        assert fragment_cache.get(key) is not None
+        body = blog.body
+        # 编辑博客之后，这篇博客的片段缓存被删除
+        blog.body = '片段缓存测试'
+        db.session.commit()
+        assert fragment_cache.get(key) is None
+        assert '片段缓存测试'.encode() in client.get(url_for('main.index')).data
+        blog.body = body
+        db.session.commit()
+
+    def test_index_fragment_cache_key_has_version(self, client):
+        client.get(url_for('main.index'))
+        blog = Blog.query.order_by(Blog.time_stamp.desc(), Blog.id.desc()
+                ).first()
+        key = fragment_key(blog)
+        # 其他进程修改了博客，本进程的缓存没有收到失效通知
+        table = Blog.__table__
+        db.session.execute(table.update().where(table.c.id == blog.id
+                ).values(updated_at=blog.updated_at + timedelta(seconds=1)))
+        db.session.commit()
+        db.session.expire_all()
+        assert fragment_cache.get(key) is not None
+        assert fragment_key(blog) != key
+        # 其他进程修改了作者的名字， key 也随之改变
+        key = fragment_key(blog)
+        users = User.__table__
+        name = blog.author.name
+        db.session.execute(users.update().where(users.c.id == blog.author_id
+                ).values(name='片段缓存测试'))
+        db.session.commit()
+        db.session.expire_all()
+        assert fragment_key(blog) != key
+        db.session.execute(users.update().where(users.c.id == blog.author_id
+                ).values(name=name))
+        db.session.commit()
+
+    def test_index_page_cache(self, client):
+        response_cache.clear()
+        resp = client.get(url_for('main.index'))
+        # 未登录用户第二次访问同一页面，直接返回缓存的响应，不执行查询
+        with assert_max_queries(0):
+            cached = client.get(url_for('main.index'))
+        assert cached.data == resp.data
+        assert 'Set-Cookie' not in cached.headers
+        # 博客修改并提交之后，整页缓存被清空
+        blog = Blog.query.first()
+        body = blog.body
+        blog.body = body + ' '
+        db.session.commit()
+        assert len(response_cache) == 0
+        blog.body = body
+        db.session.commit()
+
+    def test_search(self, client, user):
+        # 测试配置中写博客时同步更新索引，提交之后就能搜到
+        blog = Blog(body='searchtoken017 搜索测试', author=user)
+        db.session.add(blog)
+        db.session.commit()
+        resp = client.get(url_for('main.search', search='searchtoken017'))
+        assert resp.status_code == 200
+        assert resp.data.count(b"class='post'") == 1
+        assert b'searchtoken017' in resp.data
+        db.session.delete(blog)
+        db.session.commit()
+        resp = client.get(url_for('main.search', search='没有这个词'))
+        assert resp.data.count(b"class='post'") == 0
+
+    def test_index_query_count(self, client):
+        # 博客和作者在同一条查询中加载，与本页博客的数量无关
+        with assert_max_queries(2):
+            resp = client.get(url_for('main.index'))
+        assert resp.status_code == 200
+
     @login
     def test_index_after_login(self, client, user):
         resp1 = client.get(url_for('main.show_followed_blogs'), 
@@ -56,6 +137,15 @@ class TestMain:
         assert resp2.status_code == 200
         assert '查看全部'.encode() in resp2.data
 
+    @login
+    def test_index_after_login_query_count(self, client, user):
+        client.get(url_for('main.index'))
+        db.session.remove()
+        # 当前用户和角色从身份缓存中读取，只剩查询博客的一条
+        with assert_max_queries(1):
+            resp = client.get(url_for('main.index'))
+        assert resp.status_code == 200
+
     @login
     def test_confirm_user(self, client, user):
         token = user.generate_confirm_user_token()
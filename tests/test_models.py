@@ -0,0 +1,364 @@
+import gc
+import time
+from weblog import commands
+from weblog import last_seen as last_seen_module
+from weblog.app import create_app
+from weblog.models import db, User, Blog, Comment, Timeline, email_hash
+from weblog.models import reconcile_counters, roles, Role, Permission
+from weblog.identity import identity_cache, load_user
+from weblog.render import render_markdown, render_cache, render_stats
+from weblog.search import get_backend, get_queue, drain, catch_up
+from weblog.search import search_page, result_cache
+
+
+class TestModels:
+    '''测试 models 模块中映射类的方法
+    '''
+
+    def test_timeline_follow_and_unfollow(self, app, user):
+        other = User.query.get(4)
+        if user.is_following(other):
+            user.unfollow(other)
+        assert user.followed_posts.filter(Blog.author_id == other.id
+                ).count() == 0
+        user.follow(other)
+        ids = {b.id for b in user.followed_posts.filter(
+                Blog.author_id == other.id)}
+        assert ids == {b.id for b in other.blogs}
+        user.unfollow(other)
+        assert user.followed_posts.filter(Blog.author_id == other.id
+                ).count() == 0
+        user.follow(other)
+
+    def test_timeline_push_new_blog(self, app, user):
+        other = User.query.get(4)
+        if not user.is_following(other):
+            user.follow(other)
+        blog = Blog(body='时间线推送测试', author=other)
+        db.session.add(blog)
+        db.session.commit()
+        newest = user.followed_posts.order_by(
+                Timeline.time_stamp.desc()).first()
+        assert newest.id == blog.id
+        db.session.delete(blog)
+        db.session.commit()
+
+    def test_timeline_trim(self, app, user):
+        other = User(name='timeline_trim', email='timeline_trim@example.com',
+                password='timeline_trim')
+        db.session.add(other)
+        db.session.commit()
+        user_id, other_id = user.id, other.id
+        limit = app.config['TIMELINE_MAX_LENGTH']
+        try:
+            user.follow(other)
+            app.config['TIMELINE_MAX_LENGTH'] = 2
+            for i in range(3):
+                db.session.add(Blog(body='时间线裁剪测试', author=other))
+                db.session.commit()
+            # 写博客时只推送，不裁剪关注者的时间线
+            assert Timeline.query.filter_by(user_id=user_id).count() > 2
+            assert user_id in Timeline.overlong_user_ids(db.session)
+            result = app.test_cli_runner().invoke(args=['trim-timeline'])
+            assert result.exit_code == 0, result.output
+            assert Timeline.query.filter_by(user_id=user_id).count() <= 2
+            assert user_id not in Timeline.overlong_user_ids(db.session)
+        finally:
+            app.config['TIMELINE_MAX_LENGTH'] = limit
+            db.session.rollback()
+            user = User.query.get(user_id)
+            other = User.query.get(other_id)
+            user.unfollow(other)
+            # 删除用户时级联删除博客
+            db.session.delete(other)
+            db.session.commit()
+            Timeline.rebuild(db.session, user_id)
+            db.session.commit()
+
+    def test_counters(self, app, user):
+        other = User.query.get(4)
+        if user.is_following(other):
+            user.unfollow(other)
+        followers_count = other.followers_count
+        followed_count = user.followed_count
+        blogs_count = other.blogs_count
+        user.follow(other)
+        assert other.followers_count == followers_count + 1
+        assert user.followed_count == followed_count + 1
+        blog = Blog(body='计数器测试', author=other)
+        db.session.add(blog)
+        db.session.commit()
+        assert other.blogs_count == blogs_count + 1
+        comment = Comment(body='计数器测试', author=user, blog=blog)
+        db.session.add(comment)
+        db.session.commit()
+        assert blog.comments_count == 1
+        # 删除博客时级联删除评论
+        db.session.delete(blog)
+        db.session.commit()
+        assert other.blogs_count == blogs_count
+        user.unfollow(other)
+        assert other.followers_count == followers_count
+        user.follow(other)
+
+    def test_reconcile_counters(self, app, user):
+        user.blogs_count += 100
+        db.session.add(user)
+        db.session.commit()
+        users, blogs = reconcile_counters(db.session)
+        db.session.commit()
+        assert users >= 1
+        assert user.blogs_count == user.blogs.count()
+
+    def test_avatar_hash(self, app, user):
+        email = user.email
+        assert user.avatar_hash == email_hash(email)
+        user.email = 'avatar_{}'.format(email)
+        assert user.avatar_hash == email_hash(user.email)
+        assert user.avatar_hash in user.gravatar(size=40)
+        assert '?s=40&' in user.gravatar(size=40)
+        db.session.rollback()
+
+    def test_last_seen_buffer(self, app, user):
+        buffer = app.extensions['last_seen']
+        buffer.flush()
+        select = db.select([User.last_seen]).where(User.id == user.id)
+        before = db.session.execute(select).scalar()
+        user.ping()
+        # 内存中的值已经刷新，数据库中的值等缓冲区写入之后才会变
+        assert user.last_seen > before
+        assert user not in db.session.dirty
+        assert buffer.pending[user.id] == user.last_seen
+        assert db.session.execute(select).scalar() == before
+        assert buffer.flush() == 1
+        db.session.commit()
+        assert db.session.execute(select).scalar() == user.last_seen
+        assert buffer.pending == {}
+
+    def test_last_seen_flushed_without_requests(self, app, user):
+        # 之后没有请求再调用 touch ，定时器也会在时间间隔之后写入数据库
+        buffer = app.extensions['last_seen']
+        buffer.flush()
+        interval = app.config['LAST_SEEN_FLUSH_INTERVAL']
+        app.config['LAST_SEEN_FLUSH_INTERVAL'] = 0.2
+        try:
+            user.ping()
+            assert buffer.pending
+            select = db.select([User.last_seen]).where(User.id == user.id)
+            deadline = time.time() + 5
+            while buffer.pending and time.time() < deadline:
+                time.sleep(0.05)
+            assert buffer.pending == {}
+            db.session.commit()
+            assert db.session.execute(select).scalar() == user.last_seen
+        finally:
+            app.config['LAST_SEEN_FLUSH_INTERVAL'] = interval
+            buffer.flush()
+
+    def test_last_seen_buffers_are_not_kept_alive(self):
+        # 退出时的写入只注册一次，应用被回收后它的写缓冲也随之回收
+        create_app('test')
+        gc.collect()
+        count = len(last_seen_module._buffers)
+        create_app('test')
+        gc.collect()
+        assert len(last_seen_module._buffers) <= count
+
+    def test_identity_cache(self, app, user):
+        identity_cache.clear()
+        assert load_user(str(user.id)) is user
+        assert identity_cache.get(user.id) is not None
+        db.session.remove()
+        cached = load_user(str(user.id))
+        assert cached.name == user.name
+        assert cached.role.permissions == user.role.permissions
+        # 修改用户资料并提交之后，缓存被删除
+        cached.about_me = '身份缓存测试'
+        db.session.commit()
+        assert identity_cache.get(cached.id) is None
+
+    def test_role_registry(self, app, user):
+        default = Role.query.filter_by(default=True).first()
+        assert roles.default_role_id == default.id
+        assert User(name='role_registry_test').role_id == default.id
+        db.session.rollback()
+        assert user.has_permission(Permission.WRITE)
+        assert not user.is_administrator
+        # 修改角色并提交之后，角色表重新加载
+        default.permissions |= Permission.MODERATE
+        db.session.commit()
+        assert user.is_moderator
+        default.permissions &= ~Permission.MODERATE
+        db.session.commit()
+        assert not user.is_moderator
+
+    def test_role_registry_concurrent_clear(self, app, monkeypatch):
+        default = Role.query.filter_by(default=True).first()
+        lock = roles._lock
+
+        class ClearingLock:
+            '''释放锁之后立即清空角色表，模拟其他线程的提交'''
+            def __enter__(self):
+                return lock.__enter__()
+            def __exit__(self, *args):
+                lock.__exit__(*args)
+                roles._permissions = roles._default_role_id = None
+
+        monkeypatch.setattr(roles, '_lock', ClearingLock())
+        assert roles.default_role_id == default.id
+        assert roles.permissions(default.id) == default.permissions
+
+    def test_render_markdown(self, app):
+        render_cache.clear()
+        body = '**渲染缓存** http://example.com <script>alert(1)</script>'
+        html = render_markdown(body)
+        assert '<strong>渲染缓存</strong>' in html
+        assert '<a href="http://example.com"' in html
+        assert '<script>' not in html
+        renders = render_stats()['renders']
+        # 相同的正文直接从缓存中读取
+        assert Blog(body=body).body_html == html
+        assert render_stats()['renders'] == renders
+        db.session.rollback()
+
+    def test_rerender_blogs_command(self, app, tmpdir):
+        blog = Blog.query.first()
+        id, html = blog.id, blog.body_html
+        db.session.execute(Blog.__table__.update().where(
+                Blog.id == id).values(body_html='过期的 HTML'))
+        db.session.commit()
+        checkpoint = str(tmpdir.join('checkpoint'))
+        result = app.test_cli_runner().invoke(args=['rerender-blogs',
+                '--chunk-size', '20', '--processes', '2',
+                '--checkpoint', checkpoint])
+        assert result.exit_code == 0, result.output
+        assert '1 updated' in result.output
+        db.session.expire_all()
+        assert Blog.query.get(id).body_html == html
+
+    def test_rerender_blogs_skips_edited_blogs(self, app, tmpdir,
+            monkeypatch):
+        blog = Blog.query.first()
+        id, body, html = blog.id, blog.body, blog.body_html
+        db.session.execute(Blog.__table__.update().where(
+                Blog.id == id).values(body_html='过期的 HTML'))
+        db.session.commit()
+        table = Blog.__table__
+
+        class EditingPool:
+            '''在转换期间修改博客正文，模拟同时有人编辑博客'''
+            def __init__(self, processes):
+                pass
+            def __enter__(self):
+                return self
+            def __exit__(self, *args):
+                pass
+            def map(self, func, rows):
+                results = list(map(func, rows))
+                db.session.execute(table.update().where(table.c.id == id
+                        ).values(body='刚刚编辑过', body_html='<p>刚刚编辑过</p>'))
+                return results
+
+        monkeypatch.setattr(commands, 'Pool', EditingPool)
+        result = app.test_cli_runner().invoke(args=['rerender-blogs',
+                '--chunk-size', '100', '--checkpoint',
+                str(tmpdir.join('checkpoint'))])
+        assert result.exit_code == 0, result.output
+        assert '0 updated, 1 skipped' in result.output
+        db.session.expire_all()
+        assert Blog.query.get(id).body_html == '<p>刚刚编辑过</p>'
+        db.session.execute(table.update().where(table.c.id == id).values(
+                body=body, body_html=html))
+        db.session.commit()
+
+    def test_render_large_blog_in_background(self, app, user):
+        app.config['RENDER_ASYNC_THRESHOLD'] = 20
+        body = '**后台转换** ' + '很长的博客。' * 10
+        render_cache.clear()
+        blog = Blog(body=body, author=user)
+        assert blog.body_html is None
+        db.session.add(blog)
+        db.session.commit()
+        # 关闭线程池并等待转换完成，下次使用时会重新创建
+        app.extensions.pop('render_executor').shutdown(wait=True)
+        app.config['RENDER_ASYNC_THRESHOLD'] = 20000
+        db.session.expire(blog)
+        assert blog.body_html == render_markdown(body)
+        db.session.delete(blog)
+        db.session.commit()
+
+    def test_search_queue(self, app, user):
+        sync = app.config['SEARCH_INDEX_SYNC']
+        app.config['SEARCH_INDEX_SYNC'] = False
+        drain(app)
+        blog = Blog(body='queueword 搜索队列测试', author=user)
+        db.session.add(blog)
+        db.session.commit()
+        id = blog.id
+        try:
+            # 提交之后博客只是放进了队列，还没有写入索引
+            assert get_queue(app).lag()['pending'] == 1
+            assert get_backend(app).search('queueword') == []
+            assert drain(app) == 1
+            assert get_queue(app).lag()['pending'] == 0
+            assert get_backend(app).search('queueword') == [id]
+            db.session.delete(blog)
+            db.session.commit()
+            # 索引进程停止期间删除的博客，由 catch_up 找出来
+            get_queue(app).ack(2 ** 62)
+            assert catch_up(app) >= 1
+            drain(app)
+            assert get_backend(app).search('queueword') == []
+        finally:
+            # 测试失败时也删除博客和索引，清空队列，不影响其他测试
+            db.session.rollback()
+            blog = Blog.query.get(id)
+            if blog is not None:
+                db.session.delete(blog)
+                db.session.commit()
+            drain(app)
+            get_backend(app).index([], deleted=[id])
+            app.config['SEARCH_INDEX_SYNC'] = sync
+
+    def test_search_page_cache(self, app, user):
+        blogs = [Blog(body='pageword 搜索分页测试 {}'.format(i), author=user)
+                for i in range(3)]
+        db.session.add_all(blogs)
+        db.session.commit()
+        ids, total = search_page('pageword', 1, 2)
+        assert len(ids) == 2 and total == 3
+        # 第二页从缓存中切片，不再查询索引
+        hits = result_cache.hits
+        more, total = search_page('pageword', 2, 2)
+        assert len(more) == 1 and total == 3
+        assert set(ids + more) == {blog.id for blog in blogs}
+        assert result_cache.hits == hits + 1
+        # 写入索引之后索引版本号改变，缓存失效
+        for blog in blogs:
+            db.session.delete(blog)
+        db.session.commit()
+        assert search_page('pageword', 1, 2) == ([], 0)
+
+    def test_search_rebuild_and_optimize(self, app, user):
+        backend = get_backend(app)
+        blog = Blog(body='rebuildtoken019 重建索引测试', author=user)
+        db.session.add(blog)
+        db.session.commit()
+        id = blog.id
+        count = Blog.query.count()
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['search', 'rebuild',
+                '--processes', '2', '--chunk-size', '20'])
+        assert result.exit_code == 0, result.output
+        assert 'with {} blogs'.format(count) in result.output
+        assert backend.indexed_ids() == {id for (id,) in
+                db.session.query(Blog.id)}
+        result = runner.invoke(args=['search', 'optimize'])
+        assert result.exit_code == 0, result.output
+        stats = backend.stats()
+        assert stats['segments'] == 1 and stats['docs'] == count
+        assert stats['deleted'] == 0
+        # 重建之后的索引中能搜到本测试写入的博客
+        assert backend.search('rebuildtoken019') == [id]
+        db.session.delete(Blog.query.get(id))
+        db.session.commit()
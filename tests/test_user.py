@@ -1,6 +1,8 @@
+import time
 from flask import url_for
 
 from weblog.models import db, User, Blog
+from weblog.email import MailSpool, outbox, send_email
 from .base import PASSWORD, login
 
 
@@ -152,3 +154,50 @@ class TestUser:
         assert resp.status_code == 200
         assert 'User - {}'.format(name) in resp.data.decode()
         assert '成功关注此用户' in resp.data.decode()
+
+    def test_send_email_through_spool(self, app, user, smtp_server, tmpdir):
+        spool = app.extensions['outbox'].spool = MailSpool(
+                str(tmpdir.join('mail.sqlite')))
+        with app.test_request_context():
+            for i in range(3):
+                send_email(user, user.email, 'confirm_user', 'token')
+        assert spool.stats()['pending'] == 3
+        # 三封邮件用同一个 SMTP 连接发出
+        assert outbox.flush(app) == 3
+        assert len(smtp_server.messages) == 3
+        assert smtp_server.messages[0][0] == [user.email]
+        assert spool.stats()['pending'] == 0
+
+    def test_send_email_retry(self, app, user, tmpdir):
+        # 没有运行 SMTP 服务器，发送失败后稍后重试
+        spool = app.extensions['outbox'].spool = MailSpool(
+                str(tmpdir.join('mail.sqlite')))
+        with app.test_request_context():
+            id = send_email(user, user.email, 'confirm_user', 'token')
+        assert outbox.flush(app) == 0
+        assert spool.claim(10, 0) == []
+        with spool._connect() as conn:
+            attempts, due_at = conn.execute('SELECT attempts, due_at '
+                    'FROM mail WHERE id = ?', (id,)).fetchone()
+        assert attempts == 1 and due_at > time.time()
+        assert spool.stats() == {'pending': 1, 'failed': 0}
+
+    def test_mail_workers_start_on_first_request(self, app, smtp_server,
+            tmpdir):
+        # 发件箱中有上次没发完的邮件，处理第一个请求时启动的发信线程会把它发出
+        path = str(tmpdir.join('mail.sqlite'))
+        MailSpool(path).push({'subject': 'spooled', 'recipients': [
+                'spooled@example.com'], 'body': 'hello'})
+        app.config.update(MAIL_SPOOL_PATH=path, MAIL_WORKERS=1)
+        outbox.init_app(app)
+        state = app.extensions['outbox']
+        # 创建应用时（例如执行 flask 命令）不启动线程
+        assert state.threads == []
+        with app.test_client() as client:
+            client.get(url_for('main.index'))
+        assert len(state.threads) == 1
+        deadline = time.time() + 5
+        while state.spool.stats()['pending'] and time.time() < deadline:
+            time.sleep(0.05)
+        assert state.spool.stats()['pending'] == 0
+        assert smtp_server.messages[0][0] == ['spooled@example.com']
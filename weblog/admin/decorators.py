@@ -11,7 +11,7 @@ def permission_required(permission):
     def decorator(func):
         @wraps(func)
         def decorated_func(*args, **kw):
-            if not current_user.role.permissions & permission:
+            if not current_user.has_permission(permission):
                 flash('你这个号级别不够啊！', 'warning')
                 abort(403)
             return func(*args, **kw)
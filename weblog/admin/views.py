@@ -1,10 +1,18 @@
 from flask import redirect, request, render_template, current_app, url_for
+from flask import flash, jsonify
 from flask_login import login_required
 
 from . import admin
 from .forms import AdminProfileForm
 from .decorators import admin_required, moderate_required
 from ..models import db, User, Comment
+from ..pagination import paginate, count_cache
+from ..page_cache import response_cache
+from ..fragments import fragment_cache
+from ..identity import identity_cache
+from ..api.authentication import token_cache
+from ..render import render_stats
+from ..search import get_queue, result_cache
 
 
 @admin.route('admin-edit-profile/<int:id>', methods=['GET', 'POST'])
@@ -27,11 +35,12 @@ def admin_edit_profile(id):
 def moderate_comments():
     '''管理评论'''
     page = request.args.get('page', default=1, type=int)
-    pagination = Comment.query.order_by(Comment.time_stamp.desc()).paginate(
-            page,
-            per_page = current_app.config['COMMENTS_PER_PAGE'],
-            error_out = False
-    )
+    # 管理页面默认使用页码分页，URL 中带有 cursor 参数时使用游标分页
+    # 同时加载每条评论的作者
+    pagination = paginate(
+            Comment.query.options(db.joinedload(Comment.author)),
+            (Comment.time_stamp, Comment.id),
+            current_app.config['COMMENTS_PER_PAGE'], cursor=False)
     comments = pagination.items
     return render_template('moderate_comments.html', comments=comments,
             page=page, pagination=pagination)
@@ -57,3 +66,19 @@ def enable_comment(id):
     db.session.add(comment)
     db.session.commit()
     return redirect(url_for('.moderate_comments'))
+
+
+@admin.route('/cache-stats')
+@admin_required
+def cache_stats():
+    '''当前进程中各个缓存的命中情况'''
+    return jsonify({
+        'pages': response_cache.stats(),
+        'fragments': fragment_cache.stats(),
+        'counts': count_cache.stats(),
+        'identities': identity_cache.stats(),
+        'api_tokens': token_cache.stats(),
+        'render': render_stats(),
+        'search_results': result_cache.stats(),
+        'search_queue': get_queue().lag()
+    })
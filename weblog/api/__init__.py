@@ -3,4 +3,4 @@ from flask import Blueprint
 
 api = Blueprint('api', __name__, url_prefix='/api')
 
-from . import authentication, users, blogs, comments
+from . import authentication, users, blogs, comments, batch, export, changes
@@ -1,23 +1,50 @@
-from flask import g, jsonify
+import time
+from flask import g, jsonify, current_app
 from flask_httpauth import HTTPBasicAuth
 from flask_login import login_user
 
 from . import api
 from .errors import unauthorized, forbidden
+from ..cache import TTLCache
+from ..identity import load_user
 from ..models import db, User
 
 
 # 创建 flask_httpauth.HTTPBasicAuth 类（基础验证类)的实例
 basic_auth = HTTPBasicAuth()
 
+# 验证过的令牌，键为令牌，值为用户 ID
+token_cache = TTLCache(maxsize=4096)
+
+
+def verify_token(token):
+    '''根据令牌得到用户，令牌无效时返回 None
+
+    密码验证使用的 PBKDF2 哈希故意算得很慢，令牌只需要验证签名
+    验证过的令牌缓存起来，缓存的有效期不超过令牌本身的有效期
+    用户从身份缓存中读取，都命中缓存时验证令牌不执行任何查询
+    '''
+    id = token_cache.get(token)
+    if id is None:
+        verified = User.verify_auth_token(token)
+        if verified is None:
+            return None
+        id, expires_at = verified
+        ttl = min(current_app.config['API_TOKEN_CACHE_TTL'],
+                expires_at - time.time())
+        if ttl > 0:
+            token_cache.set(token, id, ttl)
+    return load_user(id)
+
 
 @basic_auth.verify_password
 # basic_auth.login_required 装饰器会调用这个函数验证请求中的用户信息
 def verify_password(email_or_token, password):
     if email_or_token == '':
         return False
+    # 使用令牌时，令牌放在用户名的位置，密码为空
     if password == '':
-        g.current_user = User().verify_auth_token(email_or_token)
+        g.current_user = verify_token(email_or_token)
         g.token_used = True
         return g.current_user is not None
     user = User.query.filter(
@@ -63,3 +90,19 @@ def auth_error():
 def before_request():
     if not g.current_user.confirmed:
         return forbidden('unconfirmed account')
+
+
+@api.route('/tokens/', methods=['POST'])
+def get_token():
+    '''使用用户名（或邮箱）和密码换取令牌
+
+    之后的请求把令牌作为用户名、密码留空，就不必每次都验证密码了
+    '''
+    # 不能用令牌换取新的令牌，否则令牌可以无限续期
+    if g.token_used:
+        return unauthorized('invalid credentials')
+    expires_in = current_app.config['API_TOKEN_EXPIRES']
+    return jsonify({
+        'token': g.current_user.generate_auth_token(expires_in),
+        'expiration': expires_in
+    })
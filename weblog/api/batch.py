@@ -0,0 +1,98 @@
+'''
+批量请求
+
+客户端展示一篇博客要分别请求博客、评论和作者，每个请求都要验证一次身份
+这里的 /api/batch 接口在一个请求里接收多个子请求，例如：
+
+    [{"method": "GET", "path": "/api/blogs/1"},
+     {"method": "GET", "path": "/api/blogs/1/comments/"}]
+
+子请求在服务器内部直接交给 api 蓝图的视图函数处理，共用本次请求的身份验证和数据库会话
+返回值是与子请求一一对应的列表，每一项包含状态码、响应头和响应体
+'''
+
+from flask import jsonify, request, current_app
+from werkzeug.exceptions import HTTPException
+
+from . import api
+from .errors import bad_request
+from ..models import db
+
+
+# 子请求的响应中不返回的响应头
+SKIPPED_HEADERS = {'content-length', 'content-type', 'set-cookie'}
+
+
+def dispatch(method, path, body=None, headers=None):
+    '''在服务器内部处理一个子请求，返回值是响应对象'''
+    app = current_app._get_current_object()
+    headers = dict(headers or {})
+    # 错误处理函数根据 Accept 决定返回 JSON 还是 HTML
+    headers.setdefault('Accept', 'application/json')
+    # 当前的应用上下文（包括 g.current_user）和数据库会话在子请求中继续使用
+    with app.test_request_context(path, method=method, json=body,
+            headers=headers, base_url=request.host_url):
+        try:
+            if request.routing_exception is not None:
+                raise request.routing_exception
+            # 只能调用 api 蓝图的接口，不能嵌套批量请求
+            if (request.blueprint != api.name or
+                    request.endpoint == 'api.batch'):
+                return app.make_response(bad_request(
+                        'path is not an api endpoint'))
+            view = app.view_functions[request.endpoint]
+            return app.make_response(view(**request.view_args))
+        except HTTPException as e:
+            return app.make_response(app.handle_user_exception(e))
+        except Exception:
+            # 一个子请求出错不影响其他子请求
+            db.session.rollback()
+            app.logger.exception('Batch sub-request failed: %s %s',
+                    method, path)
+            response = jsonify({'error': 'internal server error'})
+            response.status_code = 500
+            return response
+
+
+def _invalid(item):
+    '''检查子请求的格式，格式不对时返回错误信息'''
+    if not isinstance(item, dict):
+        return 'sub-request must be a JSON object'
+    if not isinstance(item.get('path'), str):
+        return 'sub-request must have a path'
+    if not isinstance(item.get('method', 'GET'), str):
+        return 'method must be a string'
+    headers = item.get('headers')
+    if headers is not None and not (isinstance(headers, dict) and all(
+            isinstance(value, str) for value in headers.values())):
+        return 'headers must be an object of strings'
+
+
+@api.route('/batch', methods=['POST'])
+def batch():
+    '''批量请求，请求体是子请求组成的 JSON 数组
+
+    每个子请求包含 method（默认为 GET）、path 以及可选的 body 和 headers
+    '''
+    requests = request.get_json(silent=True)
+    if not isinstance(requests, list):
+        return bad_request('request body must be a JSON array')
+    limit = current_app.config['API_BATCH_MAX_REQUESTS']
+    if len(requests) > limit:
+        return bad_request('at most {} sub-requests per batch'.format(limit))
+    results = []
+    for item in requests:
+        message = _invalid(item)
+        if message is not None:
+            results.append({'status': 400, 'headers': {},
+                    'body': {'error': 'bad request', 'message': message}})
+            continue
+        response = dispatch(item.get('method', 'GET').upper(), item['path'],
+                item.get('body'), item.get('headers'))
+        results.append({
+            'status': response.status_code,
+            'headers': {name: value for name, value in response.headers
+                    if name.lower() not in SKIPPED_HEADERS},
+            'body': response.get_json(silent=True)
+        })
+    return jsonify(results)
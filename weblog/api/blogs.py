@@ -2,30 +2,36 @@ from flask import jsonify, request, current_app, url_for, g
 
 from . import api
 from .decorators import write_required
+from .errors import forbidden
+from .lookup import lookup
 from ..models import db, User, Blog, Comment
+from ..pagination import paginate, pagination_json
+from ..conditional import make_etag, not_modified, page_validators
+from ..conditional import set_validators
 
 
-@api.route('/blogs/')
+# /api/blogs 的 GET 请求也交给本函数，不重定向，也不因为 POST 写博客的路由返回 405
+@api.route('/blogs/', strict_slashes=False)
 def get_blogs():
     '''获取全部博客
+
+    默认使用游标分页，请求参数中有 page 时使用页码分页
+    请求参数中有 ids 时按 ID 批量获取，例如 /api/blogs?ids=1,2,3
     '''
-    page = request.args.get('page', 1, type=int)
-    pagination = Blog.query.paginate(
-        page, per_page=current_app.config['BLOGS_PER_PAGE'],
-        error_out=False)
+    if 'ids' in request.args:
+        return lookup(Blog, 'blogs')
+    pagination = paginate(Blog.query, (Blog.time_stamp, Blog.id),
+        current_app.config['BLOGS_PER_PAGE'])
+    # 本页博客都没有变化时返回 304 响应，不再序列化
+    etag, last_modified = page_validators(pagination,
+        lambda blog: blog.version, lambda blog: blog.updated_at)
+    response = not_modified(etag, last_modified)
+    if response:
+        return response
     blogs = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_blogs', page=page-1)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_blogs', page=page+1)
-    return jsonify({
-        'blogs': [blog.to_json() for blog in blogs],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total
-    })
+    result = {'blogs': [blog.to_json() for blog in blogs]}
+    result.update(pagination_json(pagination, 'api.get_blogs'))
+    return set_validators(jsonify(result), etag, last_modified)
 
 
 @api.route('/blogs/<int:id>')
@@ -33,7 +39,11 @@ def get_blog(id):
     '''获取某篇博客
     '''
     blog = Blog.query.get_or_404(id)
-    return jsonify(blog.to_json())
+    etag = make_etag(*blog.version)
+    response = not_modified(etag, blog.updated_at)
+    if response:
+        return response
+    return set_validators(jsonify(blog.to_json()), etag, blog.updated_at)
 
 
 @api.route('/blogs', methods=['POST'])
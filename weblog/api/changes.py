@@ -0,0 +1,27 @@
+from flask import jsonify, request, current_app
+
+from . import api
+from .errors import bad_request, gone
+from ..changes import ExpiredCursor, decode_cursor, changes_since
+
+
+@api.route('/changes')
+def get_changes():
+    '''增量同步：获取游标之后新增、修改和删除的博客、评论和关注关系
+
+    第一次请求不带 since 参数，之后把响应中的 cursor 作为 since 参数
+    has_more 为 True 时说明还有没返回的变化，应该立即用新的游标继续请求
+    '''
+    since = request.args.get('since')
+    limit = request.args.get('limit', current_app.config['CHANGES_PER_PAGE'],
+            type=int)
+    limit = min(max(limit, 1), current_app.config['CHANGES_PER_PAGE'])
+    try:
+        cursor = decode_cursor(since) if since else None
+    except ValueError:
+        return bad_request('invalid cursor')
+    try:
+        result = changes_since(cursor, limit)
+    except ExpiredCursor:
+        return gone('cursor has expired, sync again without since')
+    return jsonify(result)
@@ -2,30 +2,32 @@ from flask import jsonify, request, current_app, g, url_for
 
 from . import api
 from .decorators import comment_required
+from .lookup import lookup
 from ..models import db, Blog, Comment
+from ..pagination import paginate, pagination_json
+from ..conditional import make_etag, not_modified, page_validators
+from ..conditional import set_validators
 
 
 @api.route('/comments')
 def get_comments():
     '''获取全部评论
+
+    请求参数中有 ids 时按 ID 批量获取，例如 /api/comments?ids=1,2,3
     '''
-    page = request.args.get('page', 1, type=int)
-    pagination = Comment.query.order_by(Comment.time_stamp.desc()).paginate(
-        page, per_page=current_app.config['COMMENTS_PER_PAGE'],
-        error_out=False)
+    if 'ids' in request.args:
+        return lookup(Comment, 'comments')
+    pagination = paginate(Comment.query, (Comment.time_stamp, Comment.id),
+        current_app.config['COMMENTS_PER_PAGE'])
+    etag, last_modified = page_validators(pagination,
+        lambda comment: comment.version, lambda comment: comment.time_stamp)
+    response = not_modified(etag, last_modified)
+    if response:
+        return response
     comments = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_comments', page=page-1)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_comments', page=page+1)
-    return jsonify({
-        'comments': [comment.to_json() for comment in comments],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total
-    })
+    result = {'comments': [comment.to_json() for comment in comments]}
+    result.update(pagination_json(pagination, 'api.get_comments'))
+    return set_validators(jsonify(result), etag, last_modified)
 
 
 @api.route('/comments/<int:id>')
@@ -33,7 +35,12 @@ def get_comment(id):
     '''获取某个评论
     '''
     comment = Comment.query.get_or_404(id)
-    return jsonify(comment.to_json())
+    etag = make_etag(*comment.version)
+    response = not_modified(etag, comment.time_stamp)
+    if response:
+        return response
+    return set_validators(jsonify(comment.to_json()), etag,
+        comment.time_stamp)
 
 
 @api.route('/blogs/<int:id>/comments/')
@@ -41,23 +48,17 @@ def get_blog_comments(id):
     '''获取某篇博客的全部评论
     '''
     blog = Blog.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = blog.comments.order_by(Comment.time_stamp.asc()).paginate(
-        page, per_page=current_app.config['COMMENTS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate(blog.comments, (Comment.time_stamp, Comment.id),
+        current_app.config['COMMENTS_PER_PAGE'], desc=False)
+    etag, last_modified = page_validators(pagination,
+        lambda comment: comment.version, lambda comment: comment.time_stamp)
+    response = not_modified(etag, last_modified)
+    if response:
+        return response
     comments = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_blog_comments', id=id, page=page-1)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_blog_comments', id=id, page=page+1)
-    return jsonify({
-        'comments': [comment.to_json() for comment in comments],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total
-    })
+    result = {'comments': [comment.to_json() for comment in comments]}
+    result.update(pagination_json(pagination, 'api.get_blog_comments', id=id))
+    return set_validators(jsonify(result), etag, last_modified)
 
 
 @api.route('/blogs/<int:id>/add_comment/', methods=['POST'])
@@ -13,7 +13,7 @@ def permission_required(permission):
         @wraps(func)
         def permission_func(*args, **kw):
             if not g.current_user.has_permission(permission):
-                forbidden('Insufficient permissions')
+                return forbidden('Insufficient permissions')
             return func(*args, **kw)
         return permission_func
     return wrapper
@@ -28,6 +28,14 @@ def forbidden(message):
     return response
 
 
+def gone(message):
+    '''请求的资源已经不存在了，例如过期的游标
+    '''
+    response = jsonify({'error': 'gone', 'message': message})
+    response.status_code = 410
+    return response
+
+
 """
 @api.errorhandler(ValidationError)
 def validation_error(e):
@@ -0,0 +1,32 @@
+from flask import Response, request, stream_with_context, abort
+
+from . import api
+from .errors import bad_request
+from ..export import EXPORTS, SINCE_FORMATS, parse_since, next_since, \
+        export_lines
+
+
+@api.route('/export/<kind>')
+def export(kind):
+    '''导出全部博客、评论或用户，响应体是 NDJSON 格式，边查询边发送
+
+    请求参数 since 只导出此时间之后修改过的数据，例如 ?since=2020-07-01T00:00:00
+    响应头 X-Export-Started-At 是下次增量导出时使用的 since 参数
+    它比导出开始的时间早 CHANGES_SETTLE_SECONDS 秒，以免漏掉还没提交的事务
+    所以增量导出是“至少一次”的，同一行数据可能在相邻两次导出中重复出现
+    用户按注册时间 created_at 增量导出，只修改了资料的老用户不会出现在增量导出中
+    '''
+    if kind not in EXPORTS:
+        abort(404)
+    since = request.args.get('since')
+    try:
+        since = parse_since(since) if since else None
+    except ValueError:
+        return bad_request('since must be like 2020-07-01T00:00:00')
+    started_at = next_since()
+    # stream_with_context 使生成器在发送响应的过程中仍然可以使用请求上下文
+    response = Response(stream_with_context(export_lines(kind, since)),
+            mimetype='application/x-ndjson')
+    response.headers['X-Export-Started-At'] = started_at.strftime(
+            SINCE_FORMATS[0])
+    return response
@@ -0,0 +1,57 @@
+'''
+按 ID 批量获取数据
+
+客户端渲染信息流时要获取多篇博客、多个用户，逐个请求的话
+每个请求都要验证身份、匹配路由、执行一条查询
+列表接口的请求参数中有 ids=1,2,3 时，用一条 IN 查询获取这些数据
+返回结果按 ids 中的顺序排列，不存在的 ID 放在 missing 字段中
+'''
+
+from flask import jsonify, request, current_app
+
+from .errors import bad_request
+from ..conditional import make_etag, not_modified, set_validators
+
+
+def parse_ids(value, limit=None):
+    '''解析逗号分隔的 ID ，返回值是去掉重复、保持顺序的整数列表
+
+    参数 limit 不为 None 时，解析到 limit + 1 个不同的 ID 就停止
+    调用者据此判断数量超限，不必解析完很长的参数
+    格式不对时抛出 ValueError 异常
+    '''
+    # 字典的键保持插入顺序，判断重复是 O(1) 的
+    ids = {}
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        ids[int(part)] = None
+        if limit is not None and len(ids) > limit:
+            break
+    return list(ids)
+
+
+def lookup(model, name):
+    '''根据请求参数 ids 批量获取 model 的数据，返回 JSON 响应
+
+    参数 name 是响应中数据列表的字段名
+    '''
+    limit = current_app.config['API_LOOKUP_MAX_IDS']
+    try:
+        ids = parse_ids(request.args['ids'], limit)
+    except ValueError:
+        return bad_request('ids must be comma-separated integers')
+    if len(ids) > limit:
+        return bad_request('at most {} ids per request'.format(limit))
+    items = model.query.filter(model.id.in_(ids)).all() if ids else []
+    found = {item.id: item for item in items}
+    items = [found[id] for id in ids if id in found]
+    etag = make_etag(request.full_path, [item.version for item in items])
+    response = not_modified(etag)
+    if response:
+        return response
+    return set_validators(jsonify({
+        name: [item.to_json() for item in items],
+        'missing': [id for id in ids if id not in found]
+    }), etag)
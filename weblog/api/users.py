@@ -1,7 +1,21 @@
 from flask import jsonify, request, current_app
 
 from . import api
-from ..models import User, Blog
+from .errors import bad_request
+from .lookup import lookup
+from ..models import User, Blog, Timeline
+from ..pagination import paginate, pagination_json
+from ..conditional import make_etag, not_modified, page_validators
+from ..conditional import set_validators
+
+
+@api.route('/users/')
+def get_users():
+    '''按 ID 批量获取用户信息，例如 /api/users/?ids=1,2,3
+    '''
+    if 'ids' not in request.args:
+        return bad_request('ids is required')
+    return lookup(User, 'users')
 
 
 @api.route('/users/<int:id>')
@@ -9,7 +23,11 @@ def get_user(id):
     '''获取某个用户信息
     '''
     user = User.query.get_or_404(id)
-    return jsonify(user.to_json())
+    etag = make_etag(*user.version)
+    response = not_modified(etag)
+    if response:
+        return response
+    return set_validators(jsonify(user.to_json()), etag)
 
 
 @api.route('/users/<int:id>/blogs/')
@@ -17,23 +35,17 @@ def get_user_blogs(id):
     '''获取某个用户的全部博客信息
     '''
     user = User.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = user.blogs.order_by(Blog.time_stamp.desc()).paginate(
-        page, per_page=current_app.config['BLOGS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate(user.blogs, (Blog.time_stamp, Blog.id),
+        current_app.config['BLOGS_PER_PAGE'])
+    etag, last_modified = page_validators(pagination,
+        lambda blog: blog.version, lambda blog: blog.updated_at)
+    response = not_modified(etag, last_modified)
+    if response:
+        return response
     blogs = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_user_blogs', id=id, page=page-1)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_user_blogs', id=id, page=page+1)
-    return jsonify({
-        'blogs': [blog.to_json() for blog in blogs],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total
-    })
+    result = {'blogs': [blog.to_json() for blog in blogs]}
+    result.update(pagination_json(pagination, 'api.get_user_blogs', id=id))
+    return set_validators(jsonify(result), etag, last_modified)
 
 
 @api.route('/users/<int:id>/followed_blogs/')
@@ -41,20 +53,17 @@ def get_user_followed_blogs(id):
     '''获取某个用户关注的其他用户的全部博客信息
     '''
     user = User.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = user.followed_blogs.order_by(Blog.time_stamp.desc()).paginate(
-        page, per_page=current_app.config['BLOGS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate(user.followed_blogs,
+        (Timeline.time_stamp, Timeline.blog_id),
+        current_app.config['BLOGS_PER_PAGE'],
+        key=lambda blog: (blog.time_stamp, blog.id))
+    etag, last_modified = page_validators(pagination,
+        lambda blog: blog.version, lambda blog: blog.updated_at)
+    response = not_modified(etag, last_modified)
+    if response:
+        return response
     blogs = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_user_followed_blogs', id=id, page=page-1)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_user_followed_blogs', id=id, page=page+1)
-    return jsonify({
-        'blogs': [blog.to_json() for blog in blogs],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total
-    })
+    result = {'blogs': [blog.to_json() for blog in blogs]}
+    result.update(pagination_json(
+        pagination, 'api.get_user_followed_blogs', id=id))
+    return set_validators(jsonify(result), etag, last_modified)
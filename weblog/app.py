@@ -7,7 +7,13 @@ from flask_login import LoginManager
 from flask_pagedown import PageDown
 
 from .configs import configs
-from .models import whooshee, db, Role, User, Blog, Comment
+from .commands import register_commands
+from .last_seen import last_seen
+from .email import outbox
+from .identity import load_user
+from .fragments import blog_fragment
+from .page_cache import page_cache
+from .models import whooshee, db, Role, User, Blog, Comment, AnonymousUser
 from .api import api
 from .main import main
 from .user import user
@@ -33,18 +39,25 @@ def register_extensions(app):
     # 该实例的 db 属性值就是这个 db ，connectors 属性值是空字典
     db.init_app(app)
     Migrate(app, db)
+    # 用户最近操作时间的写缓冲
+    last_seen.init_app(app)
+    # 未登录用户的整页缓存
+    page_cache.init_app(app)
+    # 邮件的发件箱和后台发信线程
+    outbox.init_app(app)
     PageDown(app)
+    # _blogs.html 模板使用的博客片段缓存
+    app.add_template_global(blog_fragment)
     login_manager = LoginManager(app)
 
     @login_manager.user_loader
     def user_loader(id):
-        # 只有主键才可以使用 query.get 方法查询
-        # 此方法定义在 sqlalchemy.orm.query 模块中
-        # 它会调用其它同模块中的方法查询 User 实例并返回
         # 参数 id 的数据类型为字符串
-        # 我们使用的 MySQL 数据库容错率极高，会将其转换成 int 再查寻
-        return User.query.get(id)
+        # 优先从身份缓存中读取用户和角色，缓存没有命中时才查询数据库
+        return load_user(id)
 
+    # 未登录时 current_user 是 AnonymousUser 类的实例，判断权限的结果都是 False
+    login_manager.anonymous_user = AnonymousUser
     # 未登录状态下，访问需要登录后才能访问的页面时，自动跳转到此路由
     login_manager.login_view = 'main.login'
     # 未登录状态访问需要登录的页面时给出的提示信息的内容和类型
@@ -57,5 +70,6 @@ def create_app(config):
     app.config.from_object(configs.get(config))
     register_extensions(app)    # 注册扩展
     register_blueprints(app)    # 注册蓝图
+    register_commands(app)      # 注册命令行工具
 
     return app
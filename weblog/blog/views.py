@@ -1,17 +1,19 @@
 from flask import url_for, redirect, flash, request, render_template
-from flask import current_app
+from flask import current_app, session
 from flask_login import current_user
 
 from . import blog
 from .forms import CommentForm
 from ..models import db, Permission, Blog, Comment
+from ..pagination import paginate
+from ..conditional import make_etag, not_modified, set_validators
 
 
 
 @blog.route('/<int:id>', methods=['GET', 'POST'])
 def index(id):
     '''每篇博客的单独页面，便于分享'''
-    blog = Blog.query.get_or_404(id)
+    blog = Blog.query.options(db.joinedload(Blog.author)).get_or_404(id)
     # 页面提供评论输入框
     form = CommentForm()
     if request.method == 'POST':
@@ -25,15 +27,31 @@ def index(id):
             db.session.commit()
             flash('评论成功。', 'success')
             return redirect(url_for('.index', id=id))
-    page = request.args.get('page', default=1, type=int)
-    pagination = blog.comments.order_by(Comment.time_stamp.desc()).paginate(
-            page,
-            per_page = current_app.config['COMMENTS_PER_PAGE'],
-            error_out = False
-    )
+    # 评论列表默认使用游标分页
+    # 同时加载每条评论的作者
+    pagination = paginate(
+            blog.comments.options(db.joinedload(Comment.author)),
+            (Comment.time_stamp, Comment.id),
+            current_app.config['COMMENTS_PER_PAGE'])
     comments = pagination.items
+    # 未登录用户看到的页面只取决于博客、作者和本页评论，支持条件 GET 请求
+    # 已登录用户的页面中有因人而异的按钮和带时效的表单令牌，不使用
+    etag = last_modified = None
+    if not current_user.is_authenticated and '_flashes' not in session:
+        etag = make_etag(request.full_path, blog.version,
+                blog.author.name, blog.author.avatar_hash,
+                [(c.version, c.author.name, c.author.avatar_hash)
+                for c in comments])
+        last_modified = max([blog.updated_at] +
+                [c.time_stamp for c in comments if c.time_stamp])
+        response = not_modified(etag, last_modified)
+        if response:
+            return response
     # hidebloglink 在博客页面中隐藏博客单独页面的链接
     # noblank 在博客页面中点击编辑按钮不在新标签页中打开
-    return render_template('blog.html', blogs=[blog], hidebloglink=True,
-            noblank=True, form=form, pagination=pagination,
-            comments=comments, Permission=Permission)
+    response = current_app.make_response(render_template('blog.html',
+            blogs=[blog], hidebloglink=True, noblank=True, form=form,
+            pagination=pagination, comments=comments, Permission=Permission))
+    if etag is not None:
+        set_validators(response, etag, last_modified)
+    return response
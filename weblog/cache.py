@@ -0,0 +1,134 @@
+'''
+进程内缓存
+
+gunicorn 的每个 worker 进程各有一份缓存，所以缓存的数据都要设置有效期
+有效期就是不同进程之间数据不一致的最长时间
+'''
+
+import time
+from collections import OrderedDict
+from threading import RLock
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+
+class TTLCache:
+    '''带有效期和容量上限的字典，线程安全
+
+    超出容量上限时淘汰最久没有使用的数据
+    设置数据时可以附带若干标签，之后可以按标签批量删除数据
+    '''
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        # 键为缓存的 key ，值为 (过期时间, 数据, 标签) 元组
+        self._data = OrderedDict()
+        # 键为标签，值为带有该标签的 key 的集合
+        self._tags = {}
+        self._lock = RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl, tags=()):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (time.monotonic() + ttl, value, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._data) > self.maxsize:
+                self._remove(next(iter(self._data)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def delete_tag(self, tag):
+        '''删除带有 tag 标签的全部数据'''
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._tags.clear()
+
+    def _remove(self, key):
+        _, _, tags = self._data.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        '''缓存的命中情况'''
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+
+# 事务提交之后才能删除缓存，否则其它线程可能在提交之前把旧数据重新写进缓存
+# 映射类的事件监听程序调用 mark_dirty 把需要处理的数据记录在 Session 里
+# 事务提交之后，由 commit_hook 注册的函数统一处理，事务回滚则丢弃
+_commit_hooks = {}
+
+
+def commit_hook(name):
+    '''注册事务提交之后执行的函数，该函数的参数为 mark_dirty 记录的值的集合'''
+    def decorator(func):
+        _commit_hooks.setdefault(name, []).append(func)
+        return func
+    return decorator
+
+
+def mark_dirty(target, name, value):
+    '''在 target 所属的 Session 中记录一个待处理的值
+
+    target 可以是映射类的实例，也可以是 Session 本身
+    '''
+    session = target if isinstance(target, Session) else \
+            object_session(target)
+    if session is not None:
+        session.info.setdefault('dirty', {}).setdefault(
+                name, set()).add(value)
+
+
+def _run_commit_hooks(session):
+    dirty = session.info.pop('dirty', None)
+    if not dirty:
+        return
+    for name, values in dirty.items():
+        for func in _commit_hooks.get(name, ()):
+            func(values)
+
+
+def _discard_dirty(session, previous_transaction):
+    session.info.pop('dirty', None)
+
+
+# 监听全部 Session 的事务提交和回滚事件
+event.listen(Session, 'after_commit', _run_commit_hooks)
+event.listen(Session, 'after_soft_rollback', _discard_dirty)
@@ -0,0 +1,153 @@
+'''
+增量同步
+
+客户端在本地缓存了博客、评论和关注关系，只需要获取上次同步之后的变化
+博客和评论按 (updated_at, id) 、关注关系按 (time_stamp, 关注者 ID, 被关注者 ID)
+已删除的数据按 Tombstone 的 ID ，各自用游标（keyset）记录同步到的位置
+每种数据的查询都只扫描索引上游标之后的一段范围，开销与变化的数量成正比
+
+事务在写入时间之后才提交，刚写入的数据可能晚于游标才出现
+所以只返回 CHANGES_SETTLE_SECONDS 秒之前写入的数据，游标不会越过还没提交的数据
+'''
+
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime, timedelta
+from flask import current_app, url_for
+
+from .models import db, Blog, Comment, Follow, Tombstone
+from .pagination import TIME_FORMAT
+
+
+# 游标中各种数据的位置，时间之后是用于排序的 ID 字段
+KEYSETS = {
+    'blogs': (Blog, (Blog.updated_at, Blog.id)),
+    'comments': (Comment, (Comment.updated_at, Comment.id)),
+    'follows': (Follow, (Follow.time_stamp, Follow.follower_id,
+            Follow.followed_id)),
+}
+
+
+class ExpiredCursor(ValueError):
+    '''游标早于 Tombstone 的保留期限，客户端需要重新全量同步'''
+
+
+def encode_cursor(cursor):
+    '''把各种数据的位置编码成不透明的游标字符串'''
+    data = {}
+    for kind, position in cursor.items():
+        if kind in KEYSETS:
+            time_stamp, *ids = position
+            position = [time_stamp.strftime(TIME_FORMAT)] + ids
+        elif kind == 'issued_at':
+            position = position.strftime(TIME_FORMAT)
+        data[kind] = position
+    return urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip('=')
+
+
+def decode_cursor(value):
+    '''解码游标字符串，格式不对时抛出 ValueError 异常'''
+    try:
+        padding = '=' * (-len(value) % 4)
+        data = json.loads(urlsafe_b64decode(value + padding).decode())
+        cursor = {'deleted': int(data['deleted']),
+                'issued_at': datetime.strptime(data['issued_at'],
+                TIME_FORMAT)}
+        for kind, (model, columns) in KEYSETS.items():
+            position = data.get(kind)
+            if position is not None:
+                time_stamp, *ids = position
+                if len(ids) != len(columns) - 1 or not all(
+                        isinstance(id, int) for id in ids):
+                    raise ValueError
+                cursor[kind] = tuple([datetime.strptime(time_stamp,
+                        TIME_FORMAT)] + ids)
+    except Exception:
+        raise ValueError('Invalid cursor.')
+    return cursor
+
+
+def _after(columns, position):
+    '''(a, b, c) > (x, y, z) 的展开形式，不依赖数据库对行值比较的支持'''
+    column, *rest = columns
+    value, *others = position
+    if not rest:
+        return column > value
+    return db.or_(column > value, db.and_(column == value,
+            _after(rest, others)))
+
+
+def _follow_json(follow):
+    return {
+        'follower_url': url_for('api.get_user', id=follow.follower_id),
+        'followed_url': url_for('api.get_user', id=follow.followed_id),
+        'time_stamp': follow.time_stamp
+    }
+
+
+def _tombstone_json(tombstone):
+    result = {'kind': tombstone.kind, 'deleted_at': tombstone.deleted_at}
+    if tombstone.kind == 'follow':
+        follower_id, followed_id = map(int, tombstone.key.split(':'))
+        result['follower_url'] = url_for('api.get_user', id=follower_id)
+        result['followed_url'] = url_for('api.get_user', id=followed_id)
+    else:
+        result['url'] = url_for('api.get_{}'.format(tombstone.kind),
+                id=int(tombstone.key))
+    return result
+
+
+def changes_since(cursor=None, limit=100):
+    '''获取游标之后的变化，返回值是可以序列化为 JSON 的字典
+
+    参数 cursor 是 decode_cursor 的返回值，为 None 时从头开始同步
+    每种数据最多返回 limit 条，has_more 为 True 时用新的游标继续请求
+    '''
+    now = datetime.now()
+    if cursor is not None:
+        retention = timedelta(days=current_app.config['TOMBSTONE_DAYS'])
+        if cursor['issued_at'] < now - retention:
+            raise ExpiredCursor('Cursor has expired.')
+    cursor = dict(cursor or {'deleted': 0})
+    settled = now - timedelta(
+            seconds=current_app.config['CHANGES_SETTLE_SECONDS'])
+    result = {}
+    has_more = False
+    for kind, (model, columns) in KEYSETS.items():
+        query = model.query.filter(columns[0] <= settled)
+        if kind in cursor:
+            query = query.filter(_after(columns, cursor[kind]))
+        items = query.order_by(*columns).limit(limit + 1).all()
+        has_more = has_more or len(items) > limit
+        items = items[:limit]
+        if items:
+            cursor[kind] = tuple(getattr(items[-1], column.key)
+                    for column in columns)
+        to_json = _follow_json if model is Follow else model.to_json
+        result[kind] = [to_json(item) for item in items]
+    tombstones = Tombstone.query.filter(Tombstone.id > cursor['deleted']
+            ).order_by(Tombstone.id).limit(limit + 1).all()
+    has_more = has_more or len(tombstones) > limit
+    # ID 是写入时分配的，游标只能前进到第一条还没稳定的数据之前
+    settled_count = 0
+    for tombstone in tombstones[:limit]:
+        if tombstone.deleted_at > settled:
+            break
+        settled_count += 1
+    tombstones = tombstones[:settled_count]
+    if tombstones:
+        cursor['deleted'] = tombstones[-1].id
+    result['deleted'] = [_tombstone_json(t) for t in tombstones]
+    cursor['issued_at'] = now
+    result['cursor'] = encode_cursor(cursor)
+    result['has_more'] = has_more
+    return result
+
+
+def prune_tombstones(days=None):
+    '''删除超过保留期限的 Tombstone ，返回删除的数量'''
+    days = current_app.config['TOMBSTONE_DAYS'] if days is None else days
+    table = Tombstone.__table__
+    return db.session.execute(table.delete().where(
+            table.c.deleted_at < datetime.now() - timedelta(days=days))
+            ).rowcount
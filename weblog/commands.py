@@ -0,0 +1,224 @@
+'''
+flask 命令行工具，在终端执行 flask --help 可以查看
+'''
+
+import os
+import time
+import click
+from datetime import datetime
+from multiprocessing import Pool
+from sqlalchemy import bindparam
+
+from .email import outbox
+from .changes import prune_tombstones
+from .export import EXPORTS, export_lines
+from .models import db, User, Blog, Timeline, reconcile_counters
+from .render import render_markdown
+from .search import get_backend, get_queue, drain, catch_up
+from .search.indexer import run as run_indexer, rebuild as rebuild_index
+
+
+def _rerender(row):
+    '''在进程池的子进程中转换一篇博客，参数和返回值都是 (id, HTML) 元组'''
+    id, body = row
+    return id, render_markdown(body)
+
+
+def register_commands(app):
+
+    @app.cli.command('rebuild-timeline')
+    @click.option('--user', 'user_id', type=int, default=None,
+            help='只重建该用户 ID 的时间线，默认全部用户')
+    def rebuild_timeline(user_id):
+        '''根据关注关系重建用户时间线（上线时间线功能后需执行一次）'''
+        query = db.session.query(User.id).order_by(User.id)
+        if user_id is not None:
+            query = query.filter(User.id == user_id)
+        count = 0
+        for (id,) in query.all():
+            # 每个用户一个事务，中途失败不影响已经重建好的用户
+            Timeline.rebuild(db.session, id)
+            db.session.commit()
+            count += 1
+        click.echo('Rebuilt timeline for {} users.'.format(count))
+
+    @app.cli.command('trim-timeline')
+    def trim_timeline():
+        '''删除用户时间线中超出 TIMELINE_MAX_LENGTH 的旧数据（可以由 cron 每天执行）'''
+        count = 0
+        for id in Timeline.overlong_user_ids(db.session):
+            Timeline.trim(db.session, id)
+            db.session.commit()
+            count += 1
+        click.echo('Trimmed timeline for {} users.'.format(count))
+
+    @app.cli.command('reconcile-counters')
+    def reconcile_counters_command():
+        '''根据实际数据修复用户和博客的计数器字段'''
+        users, blogs = reconcile_counters(db.session)
+        db.session.commit()
+        click.echo('Fixed counters of {} users and {} blogs.'.format(
+                users, blogs))
+
+    @app.cli.command('rerender-blogs')
+    @click.option('--chunk-size', default=500, show_default=True,
+            help='每批处理的博客数量')
+    @click.option('--processes', type=int, default=None,
+            help='进程池的进程数量，默认为 CPU 核数')
+    @click.option('--checkpoint', default=None,
+            help='断点文件路径，默认为 instance/rerender-blogs.checkpoint')
+    @click.option('--restart', is_flag=True, help='忽略断点，从头开始')
+    def rerender_blogs(chunk_size, processes, checkpoint, restart):
+        '''重新生成全部博客的 body_html （修改了 render 模块的配置后执行）'''
+        checkpoint = checkpoint or os.path.join(app.instance_path,
+                'rerender-blogs.checkpoint')
+        # 断点文件里是已经处理完的最大博客 ID ，中断后再次执行从这里继续
+        last_id = 0
+        if not restart and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                last_id = int(f.read().strip() or 0)
+            click.echo('Resuming after blog {}.'.format(last_id))
+        os.makedirs(os.path.dirname(os.path.abspath(checkpoint)),
+                exist_ok=True)
+        table = Blog.__table__
+        # 同时比较转换时读到的 body ，转换期间被编辑过的博客不会被旧的结果覆盖
+        update = table.update().where(db.and_(
+                table.c.id == bindparam('_id'),
+                table.c.body == bindparam('_body'))
+                ).values(body_html=bindparam('_html'),
+                updated_at=bindparam('_updated_at'))
+        done = changed = skipped = 0
+        start = time.perf_counter()
+        with Pool(processes) as pool:
+            while True:
+                # 按 ID 分批读取，每批只把这一批博客放进内存
+                rows = db.session.execute(db.select([table.c.id,
+                        table.c.body, table.c.body_html]).where(
+                        table.c.id > last_id).order_by(table.c.id).limit(
+                        chunk_size)).fetchall()
+                if not rows:
+                    break
+                old = {id: (body, html) for id, body, html in rows}
+                results = pool.map(_rerender,
+                        [(id, body) for id, body, _ in rows])
+                # 只更新转换结果有变化的博客
+                now = datetime.now()
+                params = [{'_id': id, '_body': old[id][0], '_html': html,
+                        '_updated_at': now}
+                        for id, html in results if html != old[id][1]]
+                matched = 0
+                if params:
+                    # executemany 的 rowcount 是每条 UPDATE 匹配行数的总和
+                    matched = db.session.execute(update, params).rowcount
+                db.session.commit()
+                last_id = rows[-1][0]
+                with open(checkpoint, 'w') as f:
+                    f.write(str(last_id))
+                done += len(rows)
+                changed += matched
+                # 没有匹配到的是转换期间被编辑或删除的博客，由保存时的转换负责
+                skipped += len(params) - matched
+                elapsed = time.perf_counter() - start
+                click.echo('{} blogs rendered, {} updated, {} skipped, '
+                        '{:.1f} blogs/s'.format(done, changed, skipped,
+                        done / elapsed))
+        # 全部完成后删除断点文件
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        click.echo('Rerendered {} blogs, {} updated, {} skipped.'.format(
+                done, changed, skipped))
+
+    @app.cli.command('prune-tombstones')
+    @click.option('--days', type=int, default=None,
+            help='保留最近多少天的记录，默认为 TOMBSTONE_DAYS 配置项')
+    def prune_tombstones_command(days):
+        '''删除过期的已删除数据记录（可以由 cron 每天执行）'''
+        count = prune_tombstones(days)
+        db.session.commit()
+        click.echo('Pruned {} tombstones.'.format(count))
+
+    @app.cli.command('export')
+    @click.argument('kind', type=click.Choice(sorted(EXPORTS)))
+    @click.option('--since', type=click.DateTime(), default=None,
+            help='只导出此时间之后修改过的数据')
+    @click.option('--output', type=click.File('w'), default='-',
+            help='输出文件，默认为标准输出')
+    def export(kind, since, output):
+        '''导出全部博客、评论或用户，每行一个 JSON 对象'''
+        # to_json 方法要用 url_for 生成 URL
+        with app.test_request_context():
+            for line in export_lines(kind, since):
+                output.write(line)
+
+    @app.cli.group('mail')
+    def mail_cli():
+        '''发件箱的维护工具'''
+
+    @mail_cli.command('send')
+    def mail_send():
+        '''立即发送发件箱中全部到期的邮件'''
+        click.echo('Sent {} emails.'.format(outbox.flush(app)))
+
+    @mail_cli.command('status')
+    def mail_status():
+        '''查看发件箱中等待发送和不再重试的邮件数量'''
+        click.echo('Pending: {pending}, failed: {failed}'.format(
+                **app.extensions['outbox'].spool.stats()))
+
+    @app.cli.group('search')
+    def search_cli():
+        '''搜索索引的维护工具'''
+
+    @search_cli.command('index')
+    @click.option('--once', is_flag=True, help='处理完队列中的数据后退出')
+    @click.option('--interval', default=1.0, show_default=True,
+            help='队列为空时每隔多少秒检查一次')
+    @click.option('--batch-size', type=int, default=None,
+            help='每次提交写入索引的博客数量上限')
+    def search_index(once, interval, batch_size):
+        '''运行索引进程，把队列中的博客写入搜索索引（每台机器只运行一个）'''
+        run_indexer(app, interval, batch_size, once, echo=click.echo)
+
+    @search_cli.command('catch-up')
+    @click.option('--since', type=click.DateTime(), default=None,
+            help='重新索引此时间之后修改过的博客，默认为最近一次写入索引的时间')
+    @click.option('--drain', 'drain_now', is_flag=True,
+            help='入队之后立即写入索引')
+    def search_catch_up(since, drain_now):
+        '''把索引进程停止期间漏掉的博客放进队列'''
+        count = catch_up(app, since)
+        click.echo('Enqueued {} blogs.'.format(count))
+        if drain_now:
+            click.echo('Indexed {} blogs.'.format(drain(app)))
+
+    @search_cli.command('status')
+    def search_status():
+        '''查看索引延迟'''
+        lag = get_queue(app).lag()
+        click.echo('Pending: {pending}, lag: {lag_seconds:.1f}s, '
+                'last indexed at: {last_indexed_at}'.format(**lag))
+
+    @search_cli.command('stats')
+    def search_stats():
+        '''查看索引的段数、文档数量和占用空间'''
+        for key, value in get_backend(app).stats().items():
+            click.echo('{}: {}'.format(key, value))
+
+    @search_cli.command('optimize')
+    def search_optimize():
+        '''合并索引的全部段（可以由 cron 定时执行）'''
+        get_backend(app).optimize()
+        click.echo('Optimized the search index.')
+
+    @search_cli.command('rebuild')
+    @click.option('--processes', type=int, default=None,
+            help='进程池的进程数量，默认为 CPU 核数')
+    @click.option('--chunk-size', default=5000, show_default=True,
+            help='每个子索引的博客数量')
+    def search_rebuild(processes, chunk_size):
+        '''根据 blog 数据表重建整个搜索索引'''
+        if not get_backend(app).uses_queue:
+            click.echo('This search backend is maintained by the database.')
+            return
+        count = rebuild_index(app, processes, chunk_size, echo=click.echo)
+        click.echo('Rebuilt the search index with {} blogs.'.format(count))
@@ -0,0 +1,83 @@
+'''
+条件 GET 请求
+
+响应中带有 ETag 和 Last-Modified 响应头
+客户端再次请求时带上 If-None-Match 或 If-Modified-Since 请求头
+资源没有变化就返回没有响应体的 304 响应，省去序列化和渲染模板
+'''
+
+import hashlib
+from datetime import timezone
+from flask import current_app, request
+
+
+def make_etag(*parts):
+    '''根据资源的版本信息生成 ETag'''
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def http_time(value):
+    '''把数据库中的本地时间（不带时区）转换成带时区的 UTC 时间
+
+    updated_at 等字段是 datetime.now() 写入的本地时间
+    Werkzeug 把不带时区的时间当作 GMT ，服务器不在 UTC 时区时 Last-Modified 就错了
+    '''
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        # 不带时区的 datetime 调用 astimezone 时按本地时间处理
+        value = value.astimezone()
+    return value.astimezone(timezone.utc)
+
+
+def set_validators(response, etag, last_modified=None):
+    '''给响应对象设置 ETag 和 Last-Modified 响应头'''
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = http_time(last_modified)
+    return response
+
+
+def not_modified(etag, last_modified=None):
+    '''资源没有变化时返回 304 响应，否则返回 None
+
+    请求中有 If-None-Match 时只比较 ETag ，否则比较 If-Modified-Since
+    '''
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    if request.if_none_match:
+        matched = request.if_none_match.contains(etag)
+    elif request.if_modified_since and last_modified is not None:
+        # Werkzeug 1.0 解析出的是不带时区的 UTC 时间
+        since = request.if_modified_since
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        # HTTP 日期只精确到秒
+        matched = http_time(last_modified).replace(microsecond=0) <= since
+    else:
+        matched = False
+    if not matched:
+        return None
+    return set_validators(current_app.response_class(status=304),
+            etag, last_modified)
+
+
+def page_validators(pagination, version, modified=None):
+    '''列表接口的 (ETag, Last-Modified) 元组
+
+    参数 version 是得到一项数据的版本信息的函数
+    参数 modified 是得到一项数据的修改时间的函数
+    ETag 由请求的 URL 、本页每项数据的版本信息以及分页状态生成
+    页码分页的分页状态是已经算好的总数，游标分页是前后两个游标
+    游标分页不为了 ETag 执行 COUNT 查询，所以本页之外的数据增减不会改变 ETag
+    Last-Modified 为本页数据中最新的修改时间
+    '''
+    if getattr(pagination, 'cursor_mode', False):
+        state = (pagination.prev_cursor, pagination.next_cursor)
+    else:
+        state = pagination.total
+    etag = make_etag(request.full_path, state,
+            [version(item) for item in pagination.items])
+    times = [modified(item) for item in pagination.items] if modified else []
+    times = [t for t in times if t is not None]
+    return etag, max(times) if times else None
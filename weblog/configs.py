@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 
 class BaseConfig:
@@ -7,7 +8,70 @@ class BaseConfig:
     BLOGS_PER_PAGE = 10
     USERS_PER_PAGE = 10
     COMMENTS_PER_PAGE = 10
+    # 分页总数缓存的有效期（秒），博客、评论和关注关系增删时缓存会被删除
+    COUNT_CACHE_TTL = 60
+    # 每个用户的时间线（「只看你关注的」）最多保留的博客数量
+    TIMELINE_MAX_LENGTH = 1000
+    # 已登录用户身份缓存（用户和角色）的有效期（秒）
+    # 用户或角色的数据修改后缓存会被删除，有效期用于兜底多个进程之间的不一致
+    IDENTITY_CACHE_TTL = 30
+    # 博客正文超过多少个字符时，在后台线程池中转换成 HTML ，0 表示不使用后台转换
+    # 转换完成之前页面显示转义后的正文
+    RENDER_ASYNC_THRESHOLD = 20000
+    # 后台转换博客正文的线程数量
+    RENDER_POOL_SIZE = 2
+    # 未登录用户整页缓存的有效期（秒），0 表示不使用整页缓存
+    # 博客、评论、关注关系和用户数据修改时缓存会被清空
+    PAGE_CACHE_TTL = 60
+    # 博客列表中每篇博客 HTML 片段的缓存有效期（秒）
+    # 博客被编辑、作者修改资料时缓存会被删除
+    FRAGMENT_CACHE_TTL = 300
+    # 进程内角色表的有效期（秒），角色数据修改后角色表会被清空
+    ROLE_REGISTRY_TTL = 300
+    # api 令牌的有效期（秒），以及验证过的令牌在进程内缓存的时间（秒）
+    API_TOKEN_EXPIRES = 3600
+    API_TOKEN_CACHE_TTL = 300
+    # api 列表接口按 ID 批量获取时，每个请求最多的 ID 数量
+    API_LOOKUP_MAX_IDS = 100
+    # /api/batch 每个请求最多的子请求数量
+    API_BATCH_MAX_REQUESTS = 20
+    # 增量同步接口每种数据每次最多返回的数量
+    CHANGES_PER_PAGE = 100
+    # 只同步多少秒之前写入的数据，等待同一时刻写入的事务提交
+    CHANGES_SETTLE_SECONDS = 5
+    # 已删除数据的记录保留多少天，早于此期限的游标需要重新全量同步
+    TOMBSTONE_DAYS = 30
     WHOOSHEE_MIN_STRING_LEN = 2
+    # 搜索后端：whoosh 为本地的 Whoosh 索引，mysql 为 MySQL 的 FULLTEXT 索引
+    SEARCH_BACKEND = 'whoosh'
+    # 搜索索引队列（SQLite 数据库文件）的路径，默认放在 Whoosh 索引目录里
+    SEARCH_QUEUE_PATH = None
+    # 索引进程每次提交写入索引的博客数量上限
+    SEARCH_INDEX_BATCH_SIZE = 500
+    # 为 True 时在提交博客的进程中直接写入索引，不需要运行索引进程
+    SEARCH_INDEX_SYNC = False
+    # 搜索结果缓存的有效期（秒）和每个搜索词缓存的结果数量
+    # 索引写入新数据之后缓存会失效，翻页超出缓存的结果数量时直接查询索引
+    SEARCH_CACHE_TTL = 60
+    SEARCH_CACHE_RESULTS = 200
+    # 索引进程每隔多少秒把索引的段合并成一个，为 0 时不合并
+    SEARCH_OPTIMIZE_INTERVAL = 24 * 3600
+    # 用户最近操作时间先记在内存里，每隔多少秒或攒够多少个用户写入一次数据库
+    # 时间间隔也就是 last_seen 字段最长的滞后时间
+    LAST_SEEN_FLUSH_INTERVAL = 60
+    LAST_SEEN_FLUSH_SIZE = 100
+    # 邮件先写进发件箱（SQLite 数据库文件），默认为 instance/mail.sqlite
+    MAIL_SPOOL_PATH = None
+    # 每个进程的发信线程数量，每个线程一次用同一个 SMTP 连接发送一批邮件
+    MAIL_WORKERS = 2
+    MAIL_BATCH_SIZE = 20
+    # 发信线程没有被唤醒时，每隔多少秒检查一次到期需要重试的邮件
+    MAIL_POLL_INTERVAL = 10
+    # 取出的邮件多少秒内没有发送完成（例如进程被杀死），就可以被其他线程重新取出
+    MAIL_SEND_TIMEOUT = 300
+    # 发送失败后第 n 次重试前等待 MAIL_RETRY_BACKOFF * 2 ** (n - 1) 秒
+    MAIL_MAX_ATTEMPTS = 5
+    MAIL_RETRY_BACKOFF = 30
     # 如果所有需要登录的页面都免登录即可访问，就设置这个
     # LOGIN_DISABLED = True
 
@@ -32,6 +96,19 @@ class TestConfig(DevConfig):
     '''
 
     WTF_CSRF_ENABLED = False
+    SEARCH_INDEX_SYNC = True
+    # 测试时用本地的调试 SMTP 服务器代替真实的邮件服务器，例如：
+    # python -m smtpd -n -c DebuggingServer localhost:1025
+    MAIL_SERVER = 'localhost'
+    MAIL_PORT = 1025
+    MAIL_USERNAME = MAIL_PASSWORD = None
+    MAIL_DEFAULT_SENDER = 'weblog@localhost'
+    MAIL_SUPPRESS_SEND = False
+    MAIL_SPOOL_PATH = os.path.join(tempfile.gettempdir(),
+            'weblog-test-mail.sqlite')
+    # 测试中不启动发信线程，需要时调用 outbox.flush 发送
+    MAIL_WORKERS = 0
+    CHANGES_SETTLE_SECONDS = 0
 
 
 configs = {
@@ -1,39 +1,243 @@
-from flask import current_app, render_template, flash
+'''
+邮件的后台发送
+
+send_email 只把邮件写进本地的发件箱（SQLite 数据库文件），然后唤醒发信线程
+每个进程最多有 MAIL_WORKERS 个发信线程，大量用户同时注册也不会创建大量线程
+发信线程每次取出一批邮件，用同一个 SMTP 连接发送
+发送失败的邮件按指数退避稍后重试，失败 MAIL_MAX_ATTEMPTS 次后不再重试
+发件箱保存在磁盘上，进程重启之后还没有发出的邮件会继续发送
+'''
+
+import json
+import os
+import smtplib
+import sqlite3
+import time
+from threading import Event, Lock, Thread
+from flask import current_app, render_template
 from flask_mail import Mail, Message
-from threading import Thread
 
 
-def send_async_email(app, msg):
-    '''该函数作为线程类实例化时 target 参数的值，在线程中执行'''
+class MailSpool:
+    '''本地发件箱，同一台机器上的多个进程可以共用'''
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            # due_at 是邮件可以发送的时间，发送失败后推迟，失败次数过多时为 NULL
+            conn.execute('CREATE TABLE IF NOT EXISTS mail ('
+                    'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                    'message TEXT NOT NULL, '
+                    'attempts INTEGER NOT NULL DEFAULT 0, '
+                    'due_at REAL, '
+                    'last_error TEXT)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_mail_due_at '
+                    'ON mail (due_at)')
+
+    def _connect(self):
+        # 多个进程同时读写，使用 WAL 模式并等待锁释放
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def push(self, message):
+        '''把邮件放进发件箱，参数 message 是 Message 类的参数组成的字典'''
+        with self._connect() as conn:
+            return conn.execute('INSERT INTO mail (message, due_at) '
+                    'VALUES (?, ?)', (json.dumps(message), time.time())
+                    ).lastrowid
+
+    def claim(self, limit, lease):
+        '''取出最多 limit 封到期的邮件，返回值是 (ID, 邮件, 失败次数) 列表
+
+        取出的邮件推迟 lease 秒，这段时间内其他发信线程不会再取出
+        发信线程中途退出的话，lease 秒之后邮件会被重新发送
+        '''
+        now = time.time()
+        conn = self._connect()
+        try:
+            # 立即加写锁，保证多个进程不会取出同一封邮件
+            conn.isolation_level = None
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute('SELECT id, message, attempts FROM mail '
+                    'WHERE due_at <= ? ORDER BY due_at, id LIMIT ?',
+                    (now, limit)).fetchall()
+            conn.executemany('UPDATE mail SET due_at = ? WHERE id = ?',
+                    [(now + lease, id) for id, _, _ in rows])
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return [(id, json.loads(message), attempts)
+                for id, message, attempts in rows]
+
+    def done(self, id):
+        '''邮件已经发出，从发件箱中删除'''
+        with self._connect() as conn:
+            conn.execute('DELETE FROM mail WHERE id = ?', (id,))
+
+    def retry(self, id, attempts, delay, error):
+        '''记录一次发送失败，delay 秒之后重试，delay 为 None 时不再重试'''
+        due_at = None if delay is None else time.time() + delay
+        with self._connect() as conn:
+            conn.execute('UPDATE mail SET attempts = ?, due_at = ?, '
+                    'last_error = ? WHERE id = ?',
+                    (attempts, due_at, error, id))
+
+    def stats(self):
+        '''等待发送和不再重试的邮件数量'''
+        with self._connect() as conn:
+            pending, failed = conn.execute('SELECT '
+                    'COUNT(due_at), COUNT(*) - COUNT(due_at) FROM mail'
+                    ).fetchone()
+        return {'pending': pending, 'failed': failed}
+
+
+class _Outbox:
+    '''某个应用的发件箱和发信线程，保存在 app.extensions['outbox'] 中'''
+
+    def __init__(self, app):
+        self.app = app
+        self.mail = Mail(app)
+        path = app.config['MAIL_SPOOL_PATH'] or os.path.join(
+                app.instance_path, 'mail.sqlite')
+        self.spool = MailSpool(path)
+        self.wakeup = Event()
+        self.lock = Lock()
+        self.threads = []
+        self.pid = None
+
+    def push(self, message):
+        '''把邮件放进发件箱并唤醒发信线程'''
+        id = self.spool.push(message)
+        self.start()
+        self.wakeup.set()
+        return id
+
+    def start(self):
+        '''启动发信线程，处理第一个请求和第一次发送邮件时调用
+
+        gunicorn 的 worker 进程是主进程 fork 出来的，不会继承主进程的线程
+        所以按进程 ID 判断当前进程中的线程是否已经启动
+        '''
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.threads = [Thread(target=self._work, daemon=True)
+                    for i in range(self.app.config['MAIL_WORKERS'])]
+            for thread in self.threads:
+                thread.start()
+
+    def _work(self):
+        '''发信线程的主循环，没有被唤醒时每隔一段时间检查一次到期的重试'''
+        while True:
+            # 线程启动后先发送一次，发件箱中上次没发完的邮件不用等待
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Failed to send mail.')
+            self.wakeup.wait(self.app.config['MAIL_POLL_INTERVAL'])
+            self.wakeup.clear()
+
+    def flush(self):
+        '''发送发件箱中全部到期的邮件，返回发出的数量'''
+        sent = 0
+        while True:
+            rows = self.spool.claim(self.app.config['MAIL_BATCH_SIZE'],
+                    self.app.config['MAIL_SEND_TIMEOUT'])
+            if not rows:
+                return sent
+            sent += self.send_batch(rows)
+
+    def send_batch(self, rows):
+        '''用同一个 SMTP 连接发送一批邮件，返回发出的数量'''
+        sent = 0
+        pending = list(rows)
+        try:
+            with self.app.app_context(), self.mail.connect() as conn:
+                while pending:
+                    id, message, attempts = pending[0]
+                    try:
+                        conn.send(Message(**message))
+                    except smtplib.SMTPServerDisconnected:
+                        raise
+                    except Exception as e:
+                        # 只是这一封邮件发送失败，例如收件人被拒绝
+                        self._retry(id, attempts, e)
+                    else:
+                        self.spool.done(id)
+                        sent += 1
+                    pending.pop(0)
+        except Exception as e:
+            # 连接失败或断开，这一批剩下的邮件全部稍后重试
+            for id, message, attempts in pending:
+                self._retry(id, attempts, e)
+        return sent
+
+    def _retry(self, id, attempts, error):
+        config = self.app.config
+        attempts += 1
+        if attempts >= config['MAIL_MAX_ATTEMPTS']:
+            delay = None
+            self.app.logger.error('Giving up mail {}: {!r}'.format(id, error))
+        else:
+            delay = config['MAIL_RETRY_BACKOFF'] * 2 ** (attempts - 1)
+        self.spool.retry(id, attempts, delay, repr(error))
+
+
+class Outbox:
+    '''邮件后台发送扩展'''
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # 发件箱的路径，默认为 instance/mail.sqlite
+        app.config.setdefault('MAIL_SPOOL_PATH', None)
+        # 每个进程的发信线程数量，为 0 时只能用 flask mail send 命令发送
+        app.config.setdefault('MAIL_WORKERS', 2)
+        app.config.setdefault('MAIL_BATCH_SIZE', 20)
+        app.config.setdefault('MAIL_POLL_INTERVAL', 10)
+        app.config.setdefault('MAIL_SEND_TIMEOUT', 300)
+        app.config.setdefault('MAIL_MAX_ATTEMPTS', 5)
+        app.config.setdefault('MAIL_RETRY_BACKOFF', 30)
+        state = app.extensions['outbox'] = _Outbox(app)
+        if app.config['MAIL_WORKERS'] > 0:
+            # 只在处理请求的进程中启动发信线程，第一个请求时开始发送发件箱里剩下的邮件
+            # 不在这里直接启动：flask 命令（会 fork 进程池）和 gunicorn 预加载应用的
+            # 主进程也会创建应用，这些进程里不应该有后台线程
+            app.before_first_request(state.start)
+
+    def flush(self, app=None):
+        '''在当前线程中发送全部到期的邮件'''
+        app = app or current_app
+        return app.extensions['outbox'].flush()
+
 
-    with app.app_context():
-        Mail(app).send(msg)
+outbox = Outbox()
 
 
 def send_email(user, email, tmp, token):
     '''
     发送邮件的主函数，参数分别是：
     当前登录用户，收件人的邮箱，前端文件名片段，token
+    返回值是邮件在发件箱中的 ID
     '''
 
-    # 如果使用多线程，就不能用 current_app 了，它被看作是一个代理
-    # 类似 socket 服务器中的主套接字，每次接收请求后都要创建一个临时套接字去处理
-    # 此处使用 current_app 对象的 _get_curent_object 方法
-    # 新创建的临时应用对象 app 包含独立的上下文信息，交给子线程处理
-    app = current_app._get_current_object()
-    # Message 是一个类，它接收以下参数：
+    # 邮件内容在请求中渲染，发件箱里保存的是 Message 类的参数：
     # 1、默认参数 subject 字符串（邮件主题
     # 2、sender 字符串（发件人邮箱
     # 3、recipients 列表（收件人邮箱列表
-    msg = Message(
-            'To: ' + user.name,
-            sender = app.config.get('MAIL_USERNAME'),
-            recipients = [email]
-    )
-    msg.body = render_template('email/{}.txt'.format(tmp), user=user, 
-            token=token)    # 纯文本文件
-    msg.html = render_template('email/{}.html'.format(tmp), user=user, 
-            token=token)    # HTML 文件
-    thread = Thread(target=send_async_email, args=(app, msg))
-    thread.start()          # 创建一个子线程并启动
-    return thread
+    message = {
+        'subject': 'To: ' + user.name,
+        'sender': current_app.config.get('MAIL_USERNAME'),
+        'recipients': [email],
+        'body': render_template('email/{}.txt'.format(tmp), user=user,
+                token=token),   # 纯文本文件
+        'html': render_template('email/{}.html'.format(tmp), user=user,
+                token=token),   # HTML 文件
+    }
+    return current_app.extensions['outbox'].push(message)
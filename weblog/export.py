@@ -0,0 +1,65 @@
+'''
+数据导出
+
+把博客、评论或用户导出为每行一个 JSON 对象的文本（NDJSON）
+数据库游标在服务器端逐批读取数据，一边读一边输出，内存占用与数据总量无关
+参数 since 只导出此时间之后修改过的数据，用于增量导出
+增量导出是“至少一次”的：相邻两次导出的时间范围有重叠，同一行数据可能出现在两次导出中
+客户端按 url 去重或覆盖即可，但不会漏掉数据
+用户没有修改时间字段，只能按注册时间 created_at 增量导出
+修改资料、计数器变化的老用户不会出现在增量导出中，需要时请全量导出
+api 蓝图的 /api/export/<kind> 接口和 flask export 命令都使用这里的函数
+'''
+
+from datetime import datetime, timedelta
+from flask import current_app, json
+
+from .models import User, Blog, Comment
+
+
+# 键为导出的数据类型，值为 (映射类, 判断是否修改过的时间字段)
+# 用户只有注册时间，增量导出只包含 since 之后注册的用户
+EXPORTS = {
+    'blogs': (Blog, Blog.updated_at),
+    'comments': (Comment, Comment.updated_at),
+    'users': (User, User.created_at),
+}
+
+# since 参数可以使用的时间格式
+SINCE_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d')
+
+
+def parse_since(value):
+    '''解析 since 参数，格式不对时抛出 ValueError 异常'''
+    for format in SINCE_FORMATS:
+        try:
+            return datetime.strptime(value, format)
+        except ValueError:
+            pass
+    raise ValueError('Invalid time: {}'.format(value))
+
+
+def next_since():
+    '''下次增量导出使用的 since 参数
+
+    修改时间是写入时的时间，事务在这之后才提交，导出开始时可能还看不到
+    所以往前留出 CHANGES_SETTLE_SECONDS 秒，这段时间内的数据下次会再导出一遍
+    '''
+    return datetime.now() - timedelta(
+            seconds=current_app.config['CHANGES_SETTLE_SECONDS'])
+
+
+def export_lines(kind, since=None, chunk_size=1000):
+    '''逐行生成导出的数据，每一行是一个 JSON 对象加换行符
+
+    需要在请求上下文中调用，to_json 方法要用 url_for 生成 URL
+    '''
+    model, modified = EXPORTS[kind]
+    query = model.query.order_by(model.id)
+    if since is not None:
+        query = query.filter(modified >= since)
+    # stream_results 使用服务器端游标，yield_per 每次只把一批数据转换成实例
+    query = query.execution_options(stream_results=True).yield_per(
+            chunk_size)
+    for item in query:
+        yield json.dumps(item.to_json()) + '\n'
@@ -0,0 +1,75 @@
+'''
+博客列表的 HTML 片段缓存
+
+首页、搜索、个人主页和博客页面都用 _blogs.html 展示博客
+每篇博客的 <li> 片段只有在博客被编辑、作者修改资料时才会变化
+所以把 _blog_item.html 的渲染结果按博客缓存起来，各个页面共用
+编辑按钮因当前用户而异，不放进缓存，每次渲染后替换片段中的占位符
+'''
+
+from flask import current_app, render_template
+from markupsafe import Markup
+
+from .cache import TTLCache, commit_hook, mark_dirty
+from .models import db, User, Blog
+
+
+# 每条缓存带有 blog:<博客 ID> 和 user:<作者 ID> 两个标签
+fragment_cache = TTLCache(maxsize=2048)
+
+ACTIONS_PLACEHOLDER = '<!-- blog-actions -->'
+
+
+def fragment_key(blog, hidebloglink=False):
+    '''博客片段的缓存 key'''
+    # key 包含片段用到的全部数据的版本：博客的修改时间、作者的名字和头像
+    # 其他进程的缓存收不到本进程的失效通知，数据变化后 key 不同，旧的缓存不会命中
+    # 正文在后台转换期间显示的是转义后的 body ，转换完成后 key 随之改变
+    author = blog.author
+    return (blog.id, blog.updated_at, blog.body_html is not None,
+            author.name, author.avatar_hash, bool(hidebloglink))
+
+
+def blog_fragment(blog, actions='', hidebloglink=False):
+    '''博客的 HTML 片段，供 _blogs.html 模板调用
+
+    参数 actions 是当前用户能看到的编辑按钮的 HTML
+    '''
+    key = fragment_key(blog, hidebloglink)
+    html = fragment_cache.get(key)
+    if html is None:
+        html = render_template('_blog_item.html', blog=blog,
+                hidebloglink=hidebloglink,
+                actions_placeholder=ACTIONS_PLACEHOLDER)
+        fragment_cache.set(key, html,
+                current_app.config['FRAGMENT_CACHE_TTL'],
+                tags=('blog:{}'.format(blog.id),
+                'user:{}'.format(blog.author_id)))
+    return Markup(html.replace(ACTIONS_PLACEHOLDER, str(actions), 1))
+
+
+def _on_blog_change(mapper, connection, target):
+    mark_dirty(target, 'fragment_blogs', target.id)
+
+
+def _on_user_change(mapper, connection, target):
+    # 作者的名字、头像都在博客片段里
+    mark_dirty(target, 'fragment_users', target.id)
+
+
+@commit_hook('fragment_blogs')
+def _invalidate_blogs(ids):
+    for id in ids:
+        fragment_cache.delete_tag('blog:{}'.format(id))
+
+
+@commit_hook('fragment_users')
+def _invalidate_users(ids):
+    for id in ids:
+        fragment_cache.delete_tag('user:{}'.format(id))
+
+
+db.event.listen(Blog, 'after_update', _on_blog_change)
+db.event.listen(Blog, 'after_delete', _on_blog_change)
+db.event.listen(User, 'after_update', _on_user_change)
+db.event.listen(User, 'after_delete', _on_user_change)
@@ -0,0 +1,97 @@
+'''
+已登录用户的身份缓存
+
+Flask-Login 在每个请求中都会调用 user_loader 查询当前用户
+然后模板中判断权限时还要再查询一次用户的角色
+这里把用户和角色的字段值缓存在进程内，命中缓存时不执行任何查询
+用户或角色的数据修改并提交之后，相关缓存会被删除
+'''
+
+from flask import current_app
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+from .cache import TTLCache, commit_hook, mark_dirty
+from .models import db, User, Role
+
+
+# 键为用户 id ，值为 (用户字段值字典, 角色字段值字典) 元组
+identity_cache = TTLCache(maxsize=4096)
+
+# 计数器字段由 Core UPDATE 语句修改，不会触发 after_update 事件，所以不缓存
+# 没有缓存的字段在首次访问时从数据库加载
+UNCACHED_COLUMNS = {'blogs_count', 'followers_count', 'followed_count'}
+
+
+def _column_values(obj):
+    '''映射类实例字段的值，字典的键为属性名'''
+    return {attr.key: getattr(obj, attr.key)
+            for attr in inspect(obj).mapper.column_attrs
+            if attr.key not in UNCACHED_COLUMNS}
+
+
+def _restore(model, values):
+    '''根据字段值重建实例，并放入当前的 db.session ，不执行查询'''
+    obj = model.__mapper__.class_manager.new_instance()
+    for key, value in values.items():
+        # 作为已提交的值写入，这样实例不会被标记为已修改
+        set_committed_value(obj, key, value)
+    make_transient_to_detached(obj)
+    # load=False 表示直接使用实例中的数据，不去数据库核对
+    return db.session.merge(obj, load=False)
+
+
+def load_user(id):
+    '''供 login_manager.user_loader 使用，优先从缓存中读取用户'''
+    try:
+        id = int(id)
+    except (TypeError, ValueError):
+        return None
+    cached = identity_cache.get(id)
+    if cached is not None:
+        # 如果当前 db.session 中已经有这个用户，直接使用
+        user = db.session.identity_map.get(
+                db.session.identity_key(User, id))
+        if user is not None:
+            return user
+        user_values, role_values = cached
+        role = _restore(Role, role_values) if role_values else None
+        user = _restore(User, user_values)
+        set_committed_value(user, 'role', role)
+        return user
+    user = User.query.options(db.joinedload(User.role)).get(id)
+    if user is not None:
+        role_values = _column_values(user.role) if user.role else None
+        identity_cache.set(id, (_column_values(user), role_values),
+                current_app.config['IDENTITY_CACHE_TTL'],
+                tags=('role:{}'.format(user.role_id),))
+    return user
+
+
+def _on_user_change(mapper, connection, target):
+    '''用户资料、密码、角色或验证状态修改时，记录需要删除缓存的用户'''
+    mark_dirty(target, 'identity_users', target.id)
+
+
+def _on_role_change(mapper, connection, target):
+    '''角色修改时，记录需要删除缓存的角色'''
+    mark_dirty(target, 'identity_roles', target.id)
+
+
+@commit_hook('identity_users')
+def _invalidate_users(ids):
+    for id in ids:
+        identity_cache.delete(id)
+
+
+@commit_hook('identity_roles')
+def _invalidate_roles(ids):
+    for id in ids:
+        identity_cache.delete_tag('role:{}'.format(id))
+
+
+db.event.listen(User, 'after_update', _on_user_change)
+db.event.listen(User, 'after_delete', _on_user_change)
+db.event.listen(Role, 'after_update', _on_role_change)
+db.event.listen(Role, 'after_delete', _on_role_change)
@@ -0,0 +1,128 @@
+'''
+用户最近操作时间的写缓冲
+
+已登录用户的每个请求都会刷新 User.last_seen ，如果每次都 UPDATE 并提交
+那么每次浏览页面都是一个写事务
+这里先把最近操作时间记在内存里，同一用户多次刷新只保留最后一次
+每隔 LAST_SEEN_FLUSH_INTERVAL 秒或者攒够 LAST_SEEN_FLUSH_SIZE 个用户
+再用一条批量 UPDATE 语句写入数据库
+缓冲区有数据时启动一个定时器，进程没有新的请求时也会按时写入
+User.ping 调用 app.extensions['last_seen'].touch 把数据放进缓冲区
+'''
+
+import atexit
+import os
+import time
+import weakref
+from threading import Lock, Timer
+from flask import current_app
+from sqlalchemy import bindparam
+
+from .models import db, User
+
+
+class _Buffer:
+    '''某个应用的写缓冲，保存在 app.extensions['last_seen'] 中'''
+
+    def __init__(self, app):
+        self.app = app
+        # 键为用户 id ，值为最近操作时间
+        self.pending = {}
+        self.lock = Lock()
+        self.last_flush = time.monotonic()
+        self.timer = None
+        self.timer_pid = None
+
+    def touch(self, user_id, last_seen):
+        '''记录一次刷新，达到时间间隔或数量上限时写入数据库'''
+        config = self.app.config
+        with self.lock:
+            self.pending[user_id] = last_seen
+            due = (len(self.pending) >= config['LAST_SEEN_FLUSH_SIZE'] or
+                    time.monotonic() - self.last_flush >=
+                    config['LAST_SEEN_FLUSH_INTERVAL'])
+            if not due:
+                self._schedule()
+        if due:
+            self.flush()
+
+    def _schedule(self):
+        '''启动定时器，最晚 LAST_SEEN_FLUSH_INTERVAL 秒后写入数据库
+
+        调用时已经持有锁，定时器已经在运行时什么也不做
+        fork 出来的进程不会继承定时器线程，所以按进程 ID 判断
+        '''
+        if self.timer is not None and self.timer_pid == os.getpid():
+            return
+        self.timer = Timer(self.app.config['LAST_SEEN_FLUSH_INTERVAL'],
+                self._on_timer)
+        self.timer.daemon = True
+        self.timer_pid = os.getpid()
+        self.timer.start()
+
+    def _on_timer(self):
+        with self.lock:
+            self.timer = None
+        self.flush()
+
+    def flush(self):
+        '''把缓冲区中的全部数据写入数据库，返回写入的用户数量'''
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.last_flush = time.monotonic()
+        if not pending:
+            return 0
+        params = [{'_id': id, '_last_seen': last_seen}
+                for id, last_seen in pending.items()]
+        # 使用单独的连接和事务，不影响当前请求的 db.session
+        statement = User.__table__.update().where(
+                User.id == bindparam('_id')).values(
+                last_seen=bindparam('_last_seen'))
+        try:
+            with db.get_engine(self.app).begin() as connection:
+                connection.execute(statement, params)
+        except Exception:
+            # 写入失败时把数据放回缓冲区，已有更新的数据不覆盖
+            with self.lock:
+                for id, last_seen in pending.items():
+                    self.pending.setdefault(id, last_seen)
+            self.app.logger.exception('Failed to flush last_seen.')
+            return 0
+        return len(pending)
+
+
+# 全部应用的写缓冲，弱引用不会阻止测试和命令行创建的应用被回收
+_buffers = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_all():
+    '''进程退出时把还存在的写缓冲写入数据库，整个进程只注册一次'''
+    for buffer in list(_buffers):
+        buffer.flush()
+
+
+class LastSeen:
+    '''最近操作时间写缓冲扩展
+
+    进程退出时（包括 gunicorn 的 worker 退出时）会把缓冲区写入数据库
+    '''
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LAST_SEEN_FLUSH_INTERVAL', 60)
+        app.config.setdefault('LAST_SEEN_FLUSH_SIZE', 100)
+        buffer = _Buffer(app)
+        app.extensions['last_seen'] = buffer
+        _buffers.add(buffer)
+
+    def flush(self, app=None):
+        '''立即把缓冲区写入数据库'''
+        app = app or current_app
+        return app.extensions['last_seen'].flush()
+
+
+last_seen = LastSeen()
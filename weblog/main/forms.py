@@ -40,7 +40,6 @@ class RegisterForm(FlaskForm):
         '''创建新用户并存入数据库，发送验证邮件'''
         user = User()
         self.populate_obj(user)
-        user.avatar_hash = user.gravatar()
         db.session.add(user)
         db.session.commit()
         # 使用令牌生成器生成 token ，将其作为邮件中验证链接的一部分
@@ -5,10 +5,13 @@
 from flask import url_for, redirect, flash, request, render_template
 from flask import current_app, make_response, jsonify
 from flask_login import login_required, login_user, logout_user, current_user
+from flask_sqlalchemy import Pagination
 
 from . import main
 from .forms import RegisterForm, LoginForm, BlogForm
-from ..models import db, User, Blog
+from ..models import db, User, Blog, Timeline
+from ..pagination import paginate
+from ..search import search_page
 
 
 # 由 before_app_request 所装饰的视图函数
@@ -50,13 +53,19 @@ def index():
             # 然后重定向到 index 视图函数，使用 GET 方法再次运行这个函数
             return redirect(url_for('.index'))
     # 根据 show_followed 变量获取查询对象
-    query = Blog.query if not show_followed else current_user.followed_posts
-    page = request.args.get('page', 1, type=int)
-    pagination = query.order_by(Blog.time_stamp.desc()).paginate(
-            page,
-            per_page = current_app.config['BLOGS_PER_PAGE'],
-            error_out = False
-    )
+    # 关注者的博客从时间线表读取，按时间线表自己的时间字段排序才能用上索引
+    # 首页默认使用游标分页，URL 中带有 page 参数时使用页码分页
+    # 模板中要用到每篇博客的作者，使用 joinedload 在同一条查询中加载作者
+    # 否则每篇博客都要单独查询一次作者
+    per_page = current_app.config['BLOGS_PER_PAGE']
+    if show_followed:
+        query = current_user.followed_posts.options(
+                db.joinedload(Blog.author))
+        pagination = paginate(query, (Timeline.time_stamp, Timeline.blog_id),
+                per_page, key=lambda blog: (blog.time_stamp, blog.id))
+    else:
+        query = Blog.query.options(db.joinedload(Blog.author))
+        pagination = paginate(query, (Blog.time_stamp, Blog.id), per_page)
     blogs = pagination.items
     return render_template('index.html', form=form, blogs=blogs, 
             show_followed=show_followed, pagination=pagination)
@@ -156,22 +165,25 @@ def search():
     form = BlogForm()
     show_followed = request.cookies.get('show_followed')
     search_str = request.args.get('search').strip()
-    pagination = Blog.query.filter_by(id=0).paginate()
 
     if len(search_str) < 2:
         flash('搜索内容不能为空或少于两个字符。', 'warning')
+        # 空的分页对象，页码固定为 1 ，否则 URL 中有 page 参数时会返回 404
+        pagination = Blog.query.filter_by(id=0).paginate(1, error_out=False)
         return render_template('index.html', form=form, blogs=[],
                 show_followed=show_followed, pagination=pagination)
         return redirect(request.referrer)
 
-    page = request.args.get('page', 1, type=int)
-    pagination = Blog.query.whooshee_search(search_str).order_by(
-        Blog.time_stamp.desc()).paginate(
-            page,
-            per_page = current_app.config['BLOGS_PER_PAGE'],
-            error_out = False
-        )
-    blogs = pagination.items
+    # 搜索结果按相关度排序，由搜索引擎分页，前面若干条结果缓存起来
+    # 数据库只查询本页的博客，不需要 OFFSET 和 COUNT
+    per_page = current_app.config['BLOGS_PER_PAGE']
+    page = max(request.args.get('page', 1, type=int), 1)
+    ids, total = search_page(search_str, page, per_page)
+    blogs = Blog.query.options(db.joinedload(Blog.author)).filter(
+            Blog.id.in_(ids)).all() if ids else []
+    position = {id: index for index, id in enumerate(ids)}
+    blogs.sort(key=lambda blog: position[blog.id])
+    pagination = Pagination(None, page, per_page, total, blogs)
 
     if pagination.total == 0:
         flash(f'没有搜索到任何包含 "{search_str}" 的结果。', 'warning')
@@ -179,7 +191,8 @@ def search():
         flash(f'搜索 "{search_str}" 结果如下。', 'success')
 
     return render_template('index.html', form=form, blogs=blogs,
-            show_followed=show_followed, pagination=pagination)
+            show_followed=show_followed, pagination=pagination,
+            search=search_str)
 
 
 # 之前的 errorhandler 装饰器只对 main 蓝图自身所属的视图函数有效
@@ -1,15 +1,21 @@
 from flask import current_app, url_for
 from flask_sqlalchemy import SQLAlchemy
-from flask_login import UserMixin
+from flask_login import UserMixin, AnonymousUserMixin
 from flask_whooshee import Whooshee
+from sqlalchemy.orm.attributes import set_committed_value
 from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from itsdangerous import BadSignature
 from datetime import datetime
-from markdown import markdown
+from functools import lru_cache
+from threading import RLock
+from concurrent.futures import ThreadPoolExecutor
 import enum
+import time
 import hashlib
-import bleach
+
+from .cache import commit_hook, mark_dirty
+from .render import render_markdown, cached_html
 
 
 whooshee = Whooshee()
@@ -61,6 +67,79 @@ class Role(db.Model):
         db.session.commit()
 
 
+class RoleRegistry:
+    '''进程内的角色表
+
+    角色数据几乎不会变化，首次使用时从数据库加载全部角色
+    之后查询默认角色和判断权限都不再访问数据库
+    角色数据修改并提交之后清空，下次使用时重新加载
+    另外设置了有效期，用于兜底多个进程之间的不一致
+    '''
+
+    def __init__(self):
+        # 键为角色 id ，值为权限值
+        self._permissions = None
+        self._default_role_id = None
+        self._expires_at = 0
+        self._lock = RLock()
+
+    def _load(self):
+        '''返回 (权限字典, 默认角色 id) ，是在锁内取得的一份快照
+
+        其他线程随时可能调用 clear ，所以调用者只使用返回值，不再读取属性
+        '''
+        with self._lock:
+            if self._permissions is None or \
+                    self._expires_at <= time.monotonic():
+                # 直接查询数据表，不把 Role 实例放进 db.session
+                table = Role.__table__
+                rows = db.session.execute(db.select([table.c.id,
+                        table.c.permissions, table.c.default])).fetchall()
+                self._permissions = {id: permissions or 0
+                        for id, permissions, _ in rows}
+                self._default_role_id = next(
+                        (id for id, _, default in rows if default), None)
+                self._expires_at = time.monotonic() + \
+                        current_app.config['ROLE_REGISTRY_TTL']
+            return self._permissions, self._default_role_id
+
+    def clear(self):
+        with self._lock:
+            self._permissions = None
+            self._default_role_id = None
+
+    @property
+    def default_role_id(self):
+        '''默认角色的 id'''
+        return self._load()[1]
+
+    def permissions(self, role_id):
+        '''角色的权限值，角色不存在时为 0'''
+        return self._load()[0].get(role_id, 0)
+
+    def has_permission(self, role_id, permission):
+        '''判断角色是否有某种权限'''
+        return bool(self.permissions(role_id) & permission)
+
+
+roles = RoleRegistry()
+
+
+def _on_role_change(mapper, connection, target):
+    mark_dirty(target, 'roles', target.id)
+
+
+@commit_hook('roles')
+def _refresh_roles(ids):
+    roles.clear()
+
+
+# Role.insert_roles 或管理员修改角色并提交之后，清空角色表
+db.event.listen(Role, 'after_insert', _on_role_change)
+db.event.listen(Role, 'after_update', _on_role_change)
+db.event.listen(Role, 'after_delete', _on_role_change)
+
+
 class Gender(enum.Enum):
     '''性别类，Roel 类中的 gender 属性要用到此类'''
 
@@ -72,12 +151,53 @@ class Follow(db.Model):
     '''存储用户关注信息的双主键映射类'''
 
     __tablename__ = 'follows'
+    # 关注列表和粉丝列表按时间分页时使用的联合索引
+    __table_args__ = (
+        db.Index('ix_follows_follower_id_time_stamp',
+                'follower_id', 'time_stamp'),
+        db.Index('ix_follows_followed_id_time_stamp',
+                'followed_id', 'time_stamp'),
+    )
 
     follower_id = db.Column(db.Integer, db.ForeignKey('user.id'),
             primary_key=True)   # 关注者 ID 
     followed_id = db.Column(db.Integer, db.ForeignKey('user.id'), 
             primary_key=True)   # 被关注者 ID
-    time_stamp = db.Column(db.DateTime, default=datetime.now)
+    # 增量同步接口按此字段查询新的关注关系
+    time_stamp = db.Column(db.DateTime, index=True, default=datetime.now)
+
+
+class Tombstone(db.Model):
+    '''已删除数据的记录，增量同步接口根据它告诉客户端哪些数据被删除了
+
+    由 Blog 、Comment 和 Follow 的 after_delete 事件监听程序写入
+    '''
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(16), nullable=False)     # blog、comment、follow
+    # 博客和评论为 ID ，关注关系为「关注者 ID:被关注者 ID」
+    key = db.Column(db.String(64), nullable=False)
+    deleted_at = db.Column(db.DateTime, index=True, default=datetime.now)
+
+
+def email_hash(email):
+    '''邮箱的 MD5 散列值，Gravatar 用它识别用户'''
+    return hashlib.md5((email or '').strip().lower().encode()).hexdigest()
+
+
+@lru_cache(maxsize=4096)
+def gravatar_url(hash, size=256, default='identicon', rating='g'):
+    '''根据邮箱散列值创建 Gravatar URL
+
+    参数：size 图片大小，default 创建默认图片的方法，算是固定写法
+    rating 图片级别：
+    G 大众级，所有人可以看
+    PG 大众级，所有人可以看，建议儿童在父母陪伴下观看（非强制）
+    R 限制级，17 岁以下须在父母陪伴下观看（强制）
+    '''
+    url = 'https://cn.gravatar.com/avatar'
+    return '{url}/{hash}?s={size}&d={default}&r={rating}'.format(
+            url=url, hash=hash, size=size, default=default, rating=rating)
 
 
 # UserMixin 是在 flask_login.mixins 模块中定义的类
@@ -103,13 +223,23 @@ class User(db.Model, UserMixin):
     _password = db.Column('password', db.String(128))
     role_id = db.Column(db.Integer, db.ForeignKey('role.id'))
     role = db.relationship('Role', backref=db.backref('users', lazy='dynamic'))
+    # 邮箱的 MD5 散列值，由 User.email 的 set 事件监听程序维护
     avatar_hash = db.Column(db.String(128))
-    # 没有参数的方法，例如 db.DateTime、datetime.utcnow 写不写括号均可
-    created_at = db.Column(db.DateTime, default=datetime.now())
+    # default 要传入 datetime.now 函数本身，每次插入数据时调用
+    # 写成 datetime.now() 的话，导入模块时就算好了，之后注册的用户都是同一个时间
+    created_at = db.Column(db.DateTime, default=datetime.now)
     # 最近操作时间，「操作」包括登录请求和登录后的任何请求
     last_seen = db.Column(db.DateTime, default=datetime.now)
     # 是否已通过邮箱验证，注册后验证前该值为 False
     confirmed = db.Column(db.Boolean, default=False)
+    # 以下三个计数器字段由 Blog 和 Follow 的事件监听程序维护
+    # 数据不一致时执行 flask reconcile-counters 修复
+    blogs_count = db.Column(db.Integer, nullable=False, default=0,
+            server_default='0')     # 写了多少篇博客
+    followers_count = db.Column(db.Integer, nullable=False, default=0,
+            server_default='0')     # 有多少粉丝
+    followed_count = db.Column(db.Integer, nullable=False, default=0,
+            server_default='0')     # 关注了多少人
     # 此属性为「我关注了谁」，属性值为查询对象，里面是 Follow 类的实例
     # 参数 foreign_keys 意为查询 User.id 值等于 Follow.follower_id 的数据
     followed = db.relationship('Follow', foreign_keys=[Follow.follower_id],
@@ -143,8 +273,9 @@ class User(db.Model, UserMixin):
         '''初始化实例，给用户增加默认角色'''
         # 先调用父类的初始化方法
         super().__init__(**kw)
-        # 给实例的 role 属性赋值
-        self.role = kw.get('role') or Role.query.filter_by(default=True).first()
+        # 没有指定角色时使用默认角色，默认角色的 id 从角色表中读取
+        if self.role is None and self.role_id is None:
+            self.role_id = roles.default_role_id
 
     def is_following(self, user):
         '''判断 self 用户是否关注了 user 用户'''
@@ -159,6 +290,8 @@ class User(db.Model, UserMixin):
         if not self.is_following(user):
             f = Follow(follower_id=self.id, followed_id=user.id)
             db.session.add(f)
+            # 把 user 最近的博客补进 self 的时间线，与关注关系在同一个事务里提交
+            Timeline.backfill(db.session, self.id, user.id)
             db.session.commit()
 
     def unfollow(self, user):
@@ -166,16 +299,18 @@ class User(db.Model, UserMixin):
         f = self.followed.filter_by(followed_id=user.id).first()
         if f:
             db.session.delete(f)
+            # 从 self 的时间线中移除 user 的全部博客
+            Timeline.remove_author(db.session, self.id, user.id)
             db.session.commit()
 
     @property
     def followed_posts(self):
         '''我关注的所有用户的全部博客'''
-        # query.join 为联表查询或者联结查询
-        # 查询 Follow 实例中被关注者 ID 等于 Post.author_id 的 Post 实例
-        # Follow 实例指的是哪些呢？关注者 ID 等于 self.id 的
-        return Blog.query.join(Follow, Follow.followed_id==Blog.author_id
-                ).filter(Follow.follower_id==self.id)
+        # 不再联结 follows 数据表现场排序，而是读取写博客时推送好的时间线
+        # 时间线表上有 (user_id, time_stamp) 联合索引
+        # 按 Timeline.time_stamp 排序时只需要扫描索引上的一段范围
+        return Blog.query.join(Timeline, Timeline.blog_id==Blog.id
+                ).filter(Timeline.user_id==self.id)
 
     @property
     def password(self):
@@ -191,9 +326,11 @@ class User(db.Model, UserMixin):
 
     def ping(self):
         '''用户登录时，自动执行此方法刷新最近操作时间'''
-        self.last_seen = datetime.now()
-        db.session.add(self)
-        db.session.commit()
+        now = datetime.now()
+        # 只修改内存中的属性值，不把实例标记为已修改，也不提交事务
+        # 写入数据库的操作由 last_seen 扩展的写缓冲批量完成
+        set_committed_value(self, 'last_seen', now)
+        current_app.extensions['last_seen'].touch(self.id, now)
 
     @property
     def serializer(self, expires_in=3600):
@@ -223,49 +360,64 @@ class User(db.Model, UserMixin):
         db.session.commit()
         return True
 
-    def generate_confirm_auth_token(self):
+    def generate_auth_token(self, expires_in=None):
         '''生成验证 api 相关请求的令牌并返回'''
-        return self.serializer.dumps({'confirm_user': self.id})
+        expires_in = expires_in or current_app.config['API_TOKEN_EXPIRES']
+        return Serializer(current_app.config['SECRET_KEY'], expires_in
+                ).dumps({'id': self.id}).decode()
+
+    @staticmethod
+    def verify_auth_token(token):
+        '''验证 api 相关请求中携带的令牌
 
-    def verify_api_token(self, token):
-        '''验证 api 相关请求中携带的令牌'''
+        只验证签名和有效期，不查询数据库
+        返回值是 (用户 ID, 过期时间戳) 元组，令牌无效时返回 None
+        '''
         try:
-            data = self.serializer.loads(token)
+            data, header = Serializer(current_app.config['SECRET_KEY']).loads(
+                    token, return_header=True)
         except BadSignature:
             return None
-        return self.__class__.query.get(data['id'])
+        if not isinstance(data, dict) or not isinstance(data.get('id'), int):
+            return None
+        return data['id'], header['exp']
 
     @property
     def is_administrator(self):
         '''判断用户是不是管理员'''
-        return self.role.permissions & Permission.ADMINISTER
+        return self.has_permission(Permission.ADMINISTER)
 
     @property
     def is_moderator(self):
         '''判断用户是不是协管员'''
-        return self.role.permissions & Permission.MODERATE
+        return self.has_permission(Permission.MODERATE)
 
     def has_permission(self, permission):
-        '''判断用户是否有某种权限'''
-        return self.role.permissions & permission
+        '''判断用户是否有某种权限，权限值从角色表中读取，不加载 self.role'''
+        return roles.has_permission(self.role_id, permission)
 
     def gravatar(self, size=256, default='identicon', rating='g'):
         '''创建 Gravatar URL 的方法，其返回值就是一个头像图片的地址'''
-        # 参数：size 图片大小，default 创建默认图片的方法，算是固定写法
-        # rating 图片级别：
-        # G 大众级，所有人可以看
-        # PG 大众级，所有人可以看，建议儿童在父母陪伴下观看（非强制）
-        # R 限制级，17 岁以下须在父母陪伴下观看（强制）
-        url = 'https://cn.gravatar.com/avatar'
-        # 这步生成 MD5 散列值，这是 CPU 密集型操作
-        hash = hashlib.md5(self.email.encode()).hexdigest()
-        return '{url}/{hash}?s={size}&d={default}&r={rating}'.format(
-                url=url, hash=hash, size=size, default=default, rating=rating)
+        # 生成 MD5 散列值是 CPU 密集型操作，所以散列值在修改邮箱时算好存起来
+        # 尚未回填散列值的旧数据在这里现算
+        hash = self.avatar_hash or email_hash(self.email)
+        return gravatar_url(hash, size, default, rating)
 
     @property
     def followed_blogs(self):
-        return Blog.query.join(Follow, Follow.followed_id == Blog.author_id)\
-            .filter(Follow.follower_id == self.id)
+        '''同 followed_posts ，供 api 蓝图使用'''
+        return self.followed_posts
+
+    @staticmethod
+    def on_changed_email(target, value, old_value, initiator):
+        '''邮箱变化时重新计算邮箱的散列值'''
+        target.avatar_hash = email_hash(value) if value else None
+
+    @property
+    def version(self):
+        '''用户的版本信息，用于生成 ETag'''
+        return (self.id, self.name, self.last_seen, self.blogs_count,
+                self.followers_count, self.followed_count)
 
     def to_json(self):
         '''将 User 实例转换成字典对象并返回'''
@@ -275,7 +427,9 @@ class User(db.Model, UserMixin):
                 'created_at': self.created_at,
                 'last_seen': self.last_seen,
                 'blogs_url': url_for('api.get_user_blogs', id=self.id),
-                'blogs_count': self.blogs.count()
+                'blogs_count': self.blogs_count,
+                'followers_count': self.followers_count,
+                'followed_count': self.followed_count
         }
         return result
         
@@ -284,14 +438,39 @@ class User(db.Model, UserMixin):
         return '<User: {}>'.format(self.name)
 
 
+# 注册、修改邮箱、编辑资料都会给 User.email 赋值，此时更新 avatar_hash
+db.event.listen(User.email, 'set', User.on_changed_email)
+
+
+class AnonymousUser(AnonymousUserMixin):
+    '''匿名用户类，未登录时 current_user 是该类的实例'''
+
+    is_administrator = False
+    is_moderator = False
+
+    def has_permission(self, permission):
+        return False
+
+
 @whooshee.register_model('body')
 class Blog(db.Model):
     '''博客映射类'''
 
+    # 游标分页按 (time_stamp, id) 排序，以下索引用于全部博客和某个用户的博客
+    __table_args__ = (
+        db.Index('ix_blog_author_id_time_stamp', 'author_id', 'time_stamp'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
-    time_stamp = db.Column(db.DateTime, default=datetime.now)
+    time_stamp = db.Column(db.DateTime, index=True, default=datetime.now)
+    # 最近修改时间，条件 GET 请求的 Last-Modified 响应头使用此字段
+    updated_at = db.Column(db.DateTime, index=True, default=datetime.now,
+            onupdate=datetime.now)
+    # 评论数量，由 Comment 的事件监听程序维护
+    comments_count = db.Column(db.Integer, nullable=False, default=0,
+            server_default='0')
     author_id = db.Column(db.Integer, 
             db.ForeignKey('user.id', ondelete='CASCADE'))
     author = db.relationship('User', backref=db.backref('blogs', lazy='dynamic',
@@ -299,21 +478,30 @@ class Blog(db.Model):
 
     # 该方法为静态方法，可以写在类外部，Blog().body 有变化时自动运行
     # target 为 Blog 类的实例，value 为实例的 body 属性值
-    # old_value 为数据库中 Blog.body_html 的值，initiator 是一个事件对象
-    # 后两个参数为事件监听程序调用此函数时固定要传入的值，在函数内部用不到
+    # old_value 为 body 原来的值，initiator 是一个事件对象
     @staticmethod
     def on_changed_body(target, value, old_value, initiator):
-        allowed_tags = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
-                        'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
-                        'h1', 'h2', 'h3', 'p']
-        # bleach.linkify 方法将 <a> 标签转换为链接
-        # bleach.clean 方法清洗 HTML 数据
-        target.body_html = bleach.linkify(bleach.clean(
-                # markdown 方法将 Markdown 文本转换为 HTML 
-                markdown(value, output_format='html'),
-                tags=allowed_tags, 
-                strip=True
-        ))
+        # 正文没有变化（例如提交了没有修改的编辑表单）时不必重新转换
+        if value == old_value and target.body_html is not None:
+            return
+        threshold = current_app.config['RENDER_ASYNC_THRESHOLD']
+        if (threshold and value and len(value) > threshold and
+                cached_html(value) is None):
+            # 正文太长时先保存，提交事务之后交给后台线程转换
+            # body_html 为 None 表示等待转换，模板中显示转义后的 body
+            target.body_html = None
+            target._render_pending = True
+            return
+        # 转换过程和允许的标签见 render 模块，相同的正文只转换一次
+        target.body_html = render_markdown(value)
+        target._render_pending = False
+
+    @staticmethod
+    def on_flush(mapper, connection, target):
+        '''博客写入数据库后，记录等待后台转换的博客 ID'''
+        if getattr(target, '_render_pending', False):
+            target._render_pending = False
+            mark_dirty(target, 'pending_renders', target.id)
 
     def to_json(self):
         '''将 Blog 实例转换成字典对象并返回'''
@@ -324,10 +512,16 @@ class Blog(db.Model):
                 'time_stamp': self.time_stamp,
                 'author_url': url_for('api.get_user', id=self.author_id),
                 'comments_url': url_for('api.get_blog_comments', id=self.id),
-                'comments_count': self.comments.count()
+                'comments_count': self.comments_count
         }
         return result
 
+    @property
+    def version(self):
+        '''博客的版本信息，用于生成 ETag'''
+        return (self.id, self.updated_at, self.comments_count,
+                self.body_html is None)
+
     @classmethod
     def from_json(cls, json_data):
         '''利用字典对象创建 Blog 类的实例并返回'''
@@ -341,14 +535,170 @@ class Blog(db.Model):
 # 当 Blog.body 的值发生变化，该事件监听程序会自动运行
 # 高效地修改 Blog.body_html 字段的值并存入数据表
 db.event.listen(Blog.body, 'set', Blog.on_changed_body)
+db.event.listen(Blog, 'after_insert', Blog.on_flush)
+db.event.listen(Blog, 'after_update', Blog.on_flush)
+
+# 转换长博客的线程池，每个应用一个，首次使用时创建
+_render_executor_lock = RLock()
+
+
+def _render_executor(app):
+    with _render_executor_lock:
+        executor = app.extensions.get('render_executor')
+        if executor is None:
+            executor = app.extensions['render_executor'] = ThreadPoolExecutor(
+                    max_workers=app.config['RENDER_POOL_SIZE'],
+                    thread_name_prefix='render')
+    return executor
+
+
+def _render_blog(app, id):
+    '''在后台线程中转换一篇博客的正文'''
+    with app.app_context():
+        table = Blog.__table__
+        try:
+            body = db.session.execute(db.select([table.c.body]).where(
+                    table.c.id == id)).scalar()
+            if body is None:
+                return
+            # 转换期间正文又被修改的话，不写入旧正文的转换结果
+            # 新正文会由它自己的后台任务转换
+            db.session.execute(table.update().where(db.and_(
+                    table.c.id == id, table.c.body == body)).values(
+                    body_html=render_markdown(body),
+                    updated_at=datetime.now()))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('Failed to render blog %s.', id)
+
+
+@commit_hook('pending_renders')
+def _submit_renders(ids):
+    app = current_app._get_current_object()
+    executor = _render_executor(app)
+    for id in ids:
+        executor.submit(_render_blog, app, id)
+
+
+class Timeline(db.Model):
+    '''用户时间线映射类，即「我关注的人写的博客」的物化结果
+
+    写博客时把博客推送到作者每个关注者的时间线里（写扩散）
+    关注 / 取关时补齐 / 移除被关注者的博客
+    每个用户的时间线保留 TIMELINE_MAX_LENGTH 条，多出来的旧数据
+    不在写博客时逐个删除，由 flask trim-timeline 命令定期清理
+    '''
+
+    __tablename__ = 'timeline'
+    __table_args__ = (
+        db.Index('ix_timeline_user_id_time_stamp', 'user_id', 'time_stamp'),
+        db.Index('ix_timeline_user_id_author_id', 'user_id', 'author_id'),
+    )
+
+    # 时间线的主人，也就是关注者
+    user_id = db.Column(db.Integer,
+            db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    blog_id = db.Column(db.Integer,
+            db.ForeignKey('blog.id', ondelete='CASCADE'), primary_key=True)
+    # 以下两个字段是从 blog 数据表冗余过来的，取关和排序时就不用联表了
+    author_id = db.Column(db.Integer,
+            db.ForeignKey('user.id', ondelete='CASCADE'))
+    time_stamp = db.Column(db.DateTime)
+
+    @staticmethod
+    def _columns():
+        return ['user_id', 'blog_id', 'author_id', 'time_stamp']
+
+    @classmethod
+    def push_blog(cls, connection, blog_id, author_id):
+        '''把一篇新博客推送到作者全部关注者的时间线里'''
+        # INSERT INTO timeline SELECT ... FROM follows JOIN blog
+        # 一条语句完成推送，不必把关注者逐个查出来
+        # 超长的时间线不在这里裁剪，否则每个关注者都要多执行两条语句
+        select = db.select([Follow.follower_id, Blog.id, Blog.author_id,
+                Blog.time_stamp]).select_from(Follow.__table__.join(
+                Blog.__table__, Blog.author_id == Follow.followed_id)
+                ).where(Blog.id == blog_id)
+        connection.execute(
+                cls.__table__.insert().from_select(cls._columns(), select))
+
+    @classmethod
+    def backfill(cls, connection, user_id, author_id):
+        '''关注 author 之后，把 author 最近的博客补进 user 的时间线'''
+        limit = current_app.config['TIMELINE_MAX_LENGTH']
+        select = db.select([db.literal(user_id), Blog.id, Blog.author_id,
+                Blog.time_stamp]).where(Blog.author_id == author_id
+                ).order_by(Blog.time_stamp.desc()).limit(limit)
+        connection.execute(
+                cls.__table__.insert().from_select(cls._columns(), select))
+        cls.trim(connection, user_id)
+
+    @classmethod
+    def remove_author(cls, connection, user_id, author_id):
+        '''取关 author 之后，从 user 的时间线里移除 author 的博客'''
+        connection.execute(cls.__table__.delete().where(db.and_(
+                cls.user_id == user_id, cls.author_id == author_id)))
+
+    @classmethod
+    def trim(cls, connection, user_id):
+        '''删除 user 时间线里超出 TIMELINE_MAX_LENGTH 的旧数据'''
+        limit = current_app.config['TIMELINE_MAX_LENGTH']
+        # 找到第 limit + 1 条数据的时间，比它旧（含）的全部删除
+        # MySQL 不支持在 DELETE 的子查询里读取同一张表，所以分两步执行
+        cutoff = connection.execute(db.select([cls.time_stamp]).where(
+                cls.user_id == user_id).order_by(cls.time_stamp.desc()
+                ).offset(limit).limit(1)).scalar()
+        if cutoff is not None:
+            connection.execute(cls.__table__.delete().where(db.and_(
+                    cls.user_id == user_id, cls.time_stamp <= cutoff)))
+
+    @classmethod
+    def overlong_user_ids(cls, connection):
+        '''时间线超过 TIMELINE_MAX_LENGTH 条的用户 ID 列表'''
+        limit = current_app.config['TIMELINE_MAX_LENGTH']
+        return [row[0] for row in connection.execute(
+                db.select([cls.user_id]).group_by(cls.user_id).having(
+                db.func.count() > limit))]
+
+    @classmethod
+    def rebuild(cls, connection, user_id):
+        '''根据 follows 数据表重新生成 user 的时间线'''
+        limit = current_app.config['TIMELINE_MAX_LENGTH']
+        connection.execute(
+                cls.__table__.delete().where(cls.user_id == user_id))
+        select = db.select([Follow.follower_id, Blog.id, Blog.author_id,
+                Blog.time_stamp]).select_from(Follow.__table__.join(
+                Blog.__table__, Blog.author_id == Follow.followed_id)
+                ).where(Follow.follower_id == user_id
+                ).order_by(Blog.time_stamp.desc()).limit(limit)
+        connection.execute(
+                cls.__table__.insert().from_select(cls._columns(), select))
+
+    @staticmethod
+    def on_blog_insert(mapper, connection, target):
+        '''博客写入数据库之后，自动推送到关注者的时间线'''
+        Timeline.push_blog(connection, target.id, target.author_id)
+
+
+# 新博客 INSERT 之后执行推送，推送与博客本身在同一个事务里
+db.event.listen(Blog, 'after_insert', Timeline.on_blog_insert)
 
 
 class Comment(db.Model):
     '''评论映射类'''
 
+    # 某篇博客的评论按时间分页时使用的联合索引
+    __table_args__ = (
+        db.Index('ix_comment_blog_id_time_stamp', 'blog_id', 'time_stamp'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     time_stamp = db.Column(db.DateTime, index=True, default=datetime.now)
+    # 最近修改时间（例如管理员屏蔽评论），增量同步接口使用此字段
+    updated_at = db.Column(db.DateTime, index=True, default=datetime.now,
+            onupdate=datetime.now)
     disable = db.Column(db.Boolean)
     author_id = db.Column(db.Integer,
             db.ForeignKey('user.id', ondelete='CASCADE'))
@@ -370,6 +720,11 @@ class Comment(db.Model):
         }
         return result
 
+    @property
+    def version(self):
+        '''评论的版本信息，用于生成 ETag ，评论的内容不会修改'''
+        return (self.id, self.disable)
+
     @classmethod
     def from_json(cls, json_data):
         '''利用字典对象创建 Comment 类的实例并返回'''
@@ -377,3 +732,90 @@ class Comment(db.Model):
         if not body:
             raise ValidationError('Comment does not have body.')
         return cls(body=body)
+
+
+def update_counter(connection, model, id, **deltas):
+    '''在数据库中把 model 实例的计数器字段加上 deltas 中对应的值
+
+    使用 UPDATE ... SET x = x + 1 语句，并发写入时计数也不会出错
+    '''
+    columns = model.__table__.c
+    values = {columns[k]: columns[k] + v for k, v in deltas.items()}
+    # 计数器也是接口返回的数据，有修改时间字段的（博客）同时更新修改时间
+    # 这样 Last-Modified 和增量同步接口才能看到计数器的变化
+    if 'updated_at' in columns:
+        values[columns.updated_at] = datetime.now()
+    connection.execute(model.__table__.update().where(columns.id == id
+            ).values(values))
+
+
+# 以下事件监听程序在写入数据的同一个事务里更新计数器
+# 删除用户或博客时，ORM 级联删除的博客、评论和关注关系也会触发 after_delete
+
+def on_blog_insert(mapper, connection, target):
+    update_counter(connection, User, target.author_id, blogs_count=1)
+
+
+def on_blog_delete(mapper, connection, target):
+    update_counter(connection, User, target.author_id, blogs_count=-1)
+
+
+def on_comment_insert(mapper, connection, target):
+    update_counter(connection, Blog, target.blog_id, comments_count=1)
+
+
+def on_comment_delete(mapper, connection, target):
+    update_counter(connection, Blog, target.blog_id, comments_count=-1)
+
+
+def on_follow_insert(mapper, connection, target):
+    update_counter(connection, User, target.follower_id, followed_count=1)
+    update_counter(connection, User, target.followed_id, followers_count=1)
+
+
+def on_follow_delete(mapper, connection, target):
+    update_counter(connection, User, target.follower_id, followed_count=-1)
+    update_counter(connection, User, target.followed_id, followers_count=-1)
+
+
+def on_delete_tombstone(mapper, connection, target):
+    '''删除博客、评论或关注关系时，在同一个事务里写入一条 Tombstone'''
+    if isinstance(target, Follow):
+        kind = 'follow'
+        key = '{}:{}'.format(target.follower_id, target.followed_id)
+    else:
+        kind, key = mapper.local_table.name, str(target.id)
+    connection.execute(Tombstone.__table__.insert().values(kind=kind,
+            key=key, deleted_at=datetime.now()))
+
+
+db.event.listen(Blog, 'after_insert', on_blog_insert)
+db.event.listen(Blog, 'after_delete', on_blog_delete)
+db.event.listen(Comment, 'after_insert', on_comment_insert)
+db.event.listen(Comment, 'after_delete', on_comment_delete)
+db.event.listen(Follow, 'after_insert', on_follow_insert)
+db.event.listen(Follow, 'after_delete', on_follow_delete)
+for model in (Blog, Comment, Follow):
+    db.event.listen(model, 'after_delete', on_delete_tombstone)
+
+
+def reconcile_counters(connection):
+    '''根据实际数据批量修复计数器字段，返回值为修复的用户和博客的数量'''
+    # 关联子查询，即 SELECT COUNT(*) FROM blog WHERE blog.author_id = user.id
+    blogs = db.select([db.func.count(Blog.id)]).where(
+            Blog.author_id == User.id).as_scalar()
+    followers = db.select([db.func.count()]).select_from(Follow.__table__
+            ).where(Follow.followed_id == User.id).as_scalar()
+    followed = db.select([db.func.count()]).select_from(Follow.__table__
+            ).where(Follow.follower_id == User.id).as_scalar()
+    comments = db.select([db.func.count(Comment.id)]).where(
+            Comment.blog_id == Blog.id).as_scalar()
+    # 只更新计数不对的数据
+    users = connection.execute(User.__table__.update().where(db.or_(
+            User.blogs_count != blogs, User.followers_count != followers,
+            User.followed_count != followed)).values(blogs_count=blogs,
+            followers_count=followers, followed_count=followed)).rowcount
+    blogs = connection.execute(Blog.__table__.update().where(
+            Blog.comments_count != comments).values(
+            comments_count=comments)).rowcount
+    return users, blogs
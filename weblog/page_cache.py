@@ -0,0 +1,92 @@
+'''
+未登录用户的整页缓存
+
+未登录用户看到的首页、博客页面和个人主页都是一样的
+这里把这些 GET 请求的响应缓存起来，key 是请求路径加查询字符串
+会话中有登录用户或 flash 消息的请求不使用缓存
+博客、评论、关注关系或用户数据修改并提交之后，清空全部缓存
+'''
+
+from flask import current_app, request, session, g
+
+from .cache import TTLCache, commit_hook, mark_dirty
+from .models import db, User, Blog, Comment, Follow
+
+
+# 键为请求路径加查询字符串，值为 (响应体, 状态码, 响应头) 元组
+response_cache = TTLCache(maxsize=512)
+
+# 使用整页缓存的视图函数
+CACHED_ENDPOINTS = {'main.index', 'blog.index', 'user.index'}
+
+# 缓存响应时去掉的响应头
+UNCACHED_HEADERS = {'set-cookie', 'content-length'}
+
+
+def _cacheable():
+    '''判断当前请求能否使用整页缓存'''
+    if not current_app.config['PAGE_CACHE_TTL']:
+        return False
+    if request.method != 'GET' or request.endpoint not in CACHED_ENDPOINTS:
+        return False
+    # 已登录或者带着「记住我」Cookie 的用户看到的页面因人而异
+    if '_user_id' in session or 'remember_token' in request.cookies:
+        return False
+    # 有待显示的 flash 消息时，页面中会包含这些消息
+    return '_flashes' not in session
+
+
+class PageCache:
+    '''整页缓存扩展'''
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PAGE_CACHE_TTL', 60)
+        # 先于蓝图的 before_request 函数执行，命中缓存时直接返回响应
+        app.before_request(self._load)
+        app.after_request(self._save)
+
+    def _load(self):
+        if not _cacheable():
+            return
+        key = request.full_path
+        cached = response_cache.get(key)
+        if cached is not None:
+            body, status, headers = cached
+            # 缓存的响应带有 ETag 时，同样支持条件 GET 请求
+            return current_app.response_class(body, status, headers
+                    ).make_conditional(request)
+        g.page_cache_key = key
+
+    def _save(self, response):
+        key = g.pop('page_cache_key', None)
+        # 处理请求的过程中会话被修改（例如添加了 flash 消息）的响应不缓存
+        if (key is None or response.status_code != 200 or
+                response.direct_passthrough or session.modified):
+            return response
+        headers = [(name, value) for name, value in response.headers
+                if name.lower() not in UNCACHED_HEADERS]
+        response_cache.set(key, (response.get_data(), response.status_code,
+                headers), current_app.config['PAGE_CACHE_TTL'])
+        return response
+
+
+def _on_change(mapper, connection, target):
+    mark_dirty(target, 'page_cache', mapper.class_.__name__)
+
+
+@commit_hook('page_cache')
+def _invalidate(names):
+    response_cache.clear()
+
+
+for model in (User, Blog, Comment, Follow):
+    db.event.listen(model, 'after_insert', _on_change)
+    db.event.listen(model, 'after_update', _on_change)
+    db.event.listen(model, 'after_delete', _on_change)
+
+
+page_cache = PageCache()
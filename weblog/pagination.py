@@ -0,0 +1,272 @@
+'''
+分页工具
+
+除了 Flask-SQLAlchemy 提供的页码分页（OFFSET 分页）之外
+这里实现了基于 (time_stamp, id) 的游标分页（keyset 分页）
+游标分页不使用 OFFSET ，翻到多深的页面都只需要扫描索引上的一小段范围
+'''
+
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
+from flask import request, url_for, current_app
+from flask_sqlalchemy import Pagination
+from sqlalchemy import Table
+from sqlalchemy.sql.util import find_tables
+
+from .cache import TTLCache, commit_hook, mark_dirty
+from .models import db, Blog, Comment, Follow
+
+
+# 游标中时间的格式，精确到微秒，保证编码解码前后的值相等
+TIME_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def encode_cursor(time_stamp, id, direction='next'):
+    '''把排序字段的值编码成一个不透明的游标字符串'''
+    data = [direction, time_stamp.strftime(TIME_FORMAT), id]
+    return urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    '''解码游标字符串，返回值是 (direction, time_stamp, id) 元组
+
+    游标格式不对时抛出 ValueError 异常
+    '''
+    try:
+        # 编码时去掉了末尾的 = ，这里补齐
+        padding = '=' * (-len(cursor) % 4)
+        direction, time_stamp, id = json.loads(
+                urlsafe_b64decode(cursor + padding).decode())
+        time_stamp = datetime.strptime(time_stamp, TIME_FORMAT)
+    except Exception:
+        raise ValueError('Invalid cursor.')
+    if direction not in ('next', 'prev') or not isinstance(id, int):
+        raise ValueError('Invalid cursor.')
+    return direction, time_stamp, id
+
+
+# 分页总数的缓存，key 是 COUNT 查询的 SQL 语句和参数，即查询的「形状」
+# 每条缓存数据以相关的数据表名作为标签
+count_cache = TTLCache(maxsize=2048)
+
+# 这些映射类的数据增加或删除之后，删除相关数据表的总数缓存
+# 博客和关注关系的变化也会改变 timeline 数据表
+COUNT_TABLES = {
+    Blog: ('blog', 'timeline'),
+    Comment: ('comment',),
+    Follow: ('follows', 'timeline'),
+}
+
+
+def _count_tables(query):
+    '''查询对象用到的全部数据表名'''
+    return {table.name for table in find_tables(query.statement,
+            include_joins=True) if isinstance(table, Table)}
+
+
+def cached_count(query):
+    '''查询对象的数据总数，优先从缓存中读取'''
+    # 计算总数时不需要预加载关联对象
+    query = query.order_by(None).enable_eagerloads(False)
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    key = (str(compiled), repr(sorted(compiled.params.items())))
+    total = count_cache.get(key)
+    if total is None:
+        total = query.count()
+        count_cache.set(key, total, current_app.config['COUNT_CACHE_TTL'],
+                tags=_count_tables(query))
+    return total
+
+
+def approximate_count(query):
+    '''查询对象的近似总数
+
+    没有 WHERE 条件的单表查询使用 MySQL 的表统计信息，不扫描数据表
+    其它情况以及非 MySQL 数据库，返回 cached_count 的结果
+    '''
+    query = query.order_by(None).enable_eagerloads(False)
+    tables = _count_tables(query)
+    if (db.engine.dialect.name == 'mysql' and len(tables) == 1 and
+            query.whereclause is None):
+        total = db.session.execute(
+                'SELECT TABLE_ROWS FROM information_schema.TABLES '
+                'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :name',
+                {'name': tables.pop()}).scalar()
+        if total is not None:
+            return int(total)
+    return cached_count(query)
+
+
+def _on_count_change(mapper, connection, target):
+    '''数据增加或删除时，记录需要删除总数缓存的数据表'''
+    for table in COUNT_TABLES[mapper.class_]:
+        mark_dirty(target, 'count_tables', table)
+
+
+@commit_hook('count_tables')
+def _invalidate_counts(tables):
+    for table in tables:
+        count_cache.delete_tag(table)
+
+
+for model in COUNT_TABLES:
+    db.event.listen(model, 'after_insert', _on_count_change)
+    db.event.listen(model, 'after_delete', _on_count_change)
+
+
+class CursorPagination:
+    '''游标分页对象
+
+    属性与 Flask-SQLAlchemy 的 Pagination 对象保持相近
+    模板和视图函数可以用 cursor_mode 属性区分两种分页对象
+    '''
+
+    cursor_mode = True
+
+    def __init__(self, query, per_page, items, next_cursor, prev_cursor):
+        # query 是未排序、未分页的查询对象，用于计算总数
+        self.query = query
+        self.per_page = per_page
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    @property
+    def total(self):
+        '''数据总数，只有用到的时候才执行 COUNT 查询'''
+        if not hasattr(self, '_total'):
+            self._total = cached_count(self.query)
+        return self._total
+
+
+def cursor_paginate(query, columns, cursor, per_page, desc=True, key=None):
+    '''游标分页
+
+    参数 columns 是 (时间字段, ID 字段) 元组，查询结果按照它们排序
+    参数 key 是从查询结果中取得 (时间, ID) 的函数
+    默认使用查询结果中与 columns 同名的属性
+    '''
+    time_column, id_column = columns
+    if key is None:
+        key = lambda item: (getattr(item, time_column.key),
+                getattr(item, id_column.key))
+    direction, time_stamp, id = 'next', None, None
+    if cursor:
+        try:
+            direction, time_stamp, id = decode_cursor(cursor)
+        except ValueError:
+            # 游标无效时返回第一页
+            direction, time_stamp, id = 'next', None, None
+    # 向前翻页时，把比较方向和排序方向都反过来，查询完成后再把结果倒序
+    reverse = direction == 'prev'
+    descending = desc != reverse
+    paged = query
+    if time_stamp is not None:
+        if descending:
+            paged = paged.filter(db.or_(time_column < time_stamp, db.and_(
+                    time_column == time_stamp, id_column < id)))
+        else:
+            paged = paged.filter(db.or_(time_column > time_stamp, db.and_(
+                    time_column == time_stamp, id_column > id)))
+    if descending:
+        paged = paged.order_by(time_column.desc(), id_column.desc())
+    else:
+        paged = paged.order_by(time_column.asc(), id_column.asc())
+    # 多查一条数据，用来判断后面还有没有数据
+    items = paged.limit(per_page + 1).all()
+    more = len(items) > per_page
+    items = items[:per_page]
+    if reverse:
+        if not more:
+            # 已经翻回到最前面了，直接返回第一页，保证第一页是满的
+            return cursor_paginate(query, columns, None, per_page, desc, key)
+        items.reverse()
+        prev_cursor = encode_cursor(*key(items[0]), 'prev')
+        next_cursor = encode_cursor(*key(items[-1]))
+    else:
+        prev_cursor = None
+        if time_stamp is not None and items:
+            prev_cursor = encode_cursor(*key(items[0]), 'prev')
+        next_cursor = encode_cursor(*key(items[-1])) if more else None
+    return CursorPagination(query, per_page, items, next_cursor, prev_cursor)
+
+
+def paginate(query, columns, per_page, desc=True, key=None, cursor=True):
+    '''根据请求参数对查询对象分页
+
+    请求参数中有 page 时使用页码分页，有 cursor 时使用游标分页
+    两者都没有时，参数 cursor 决定默认使用哪种分页方式
+    '''
+    if 'page' not in request.args and ('cursor' in request.args or cursor):
+        return cursor_paginate(query, columns, request.args.get('cursor'),
+                per_page, desc, key)
+    time_column, id_column = columns
+    if desc:
+        query = query.order_by(time_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(time_column.asc(), id_column.asc())
+    page = request.args.get('page', 1, type=int)
+    if page < 1:
+        page = 1
+    # 与 query.paginate 相同，只是总数从缓存中读取
+    items = query.limit(per_page).offset((page - 1) * per_page).all()
+    if page == 1 and len(items) < per_page:
+        # 第一页没有满，总数就是本页数据的数量，不必再查
+        total = len(items)
+    elif _approx_requested():
+        # 先决定使用近似总数，避免先执行一次精确的 COUNT 查询
+        total = approximate_count(query)
+    else:
+        total = cached_count(query)
+    return Pagination(query, page, per_page, total, items)
+
+
+def _approx_requested():
+    '''请求参数中有 approx=1 时使用近似总数'''
+    return bool(request.args.get('approx', 0, type=int))
+
+
+def pagination_urls(pagination, endpoint, **kw):
+    '''生成上一页和下一页的 URL ，供 api 蓝图使用'''
+    prev = next = None
+    if getattr(pagination, 'cursor_mode', False):
+        if pagination.has_prev:
+            prev = url_for(endpoint, cursor=pagination.prev_cursor, **kw)
+        if pagination.has_next:
+            next = url_for(endpoint, cursor=pagination.next_cursor, **kw)
+    else:
+        if pagination.has_prev:
+            prev = url_for(endpoint, page=pagination.prev_num, **kw)
+        if pagination.has_next:
+            next = url_for(endpoint, page=pagination.next_num, **kw)
+    return prev, next
+
+
+def pagination_json(pagination, endpoint, **kw):
+    '''api 蓝图列表接口返回的分页信息
+
+    请求参数中有 approx=1 时，count 字段为近似总数
+    '''
+    prev, next = pagination_urls(pagination, endpoint, **kw)
+    # 页码分页的总数在 paginate 中已经按 approx 参数计算好了
+    # 游标分页的总数在用到时才计算
+    if getattr(pagination, 'cursor_mode', False) and _approx_requested():
+        count = approximate_count(pagination.query)
+    else:
+        count = pagination.total
+    return {
+        'prev': prev,
+        'next': next,
+        'prev_cursor': getattr(pagination, 'prev_cursor', None),
+        'next_cursor': getattr(pagination, 'next_cursor', None),
+        'count': count
+    }
@@ -0,0 +1,105 @@
+'''
+把博客的 Markdown 文本转换成安全的 HTML
+
+转换分三步：markdown 生成 HTML ，bleach 清洗标签，bleach 把网址转换成链接
+结果按「正文 + 转换配置」的散列值缓存，相同的正文不会重复转换
+bleach 的 Cleaner 、Linker 和 Markdown 对象都不是线程安全的
+所以每个线程创建一份，之后重复使用
+'''
+
+import hashlib
+import logging
+import threading
+import time
+from bleach.linkifier import Linker
+from bleach.sanitizer import Cleaner
+from markdown import Markdown
+
+from .cache import TTLCache
+
+
+logger = logging.getLogger(__name__)
+
+# 清洗 HTML 时保留的标签，其余标签会被去掉
+ALLOWED_TAGS = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
+                'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
+                'h1', 'h2', 'h3', 'p']
+MARKDOWN_EXTENSIONS = []
+# 转换时间超过这个值（秒）的正文记录到日志里
+SLOW_RENDER_SECONDS = 0.2
+# 缓存的 key 是正文的散列值，正文不变结果就不变，有效期只用于释放内存
+RENDER_CACHE_TTL = 24 * 3600
+
+# 转换配置的指纹，修改上面的配置后缓存自动失效
+CONFIG_HASH = hashlib.sha1(repr((ALLOWED_TAGS, MARKDOWN_EXTENSIONS)
+        ).encode()).hexdigest()
+
+render_cache = TTLCache(maxsize=1024)
+
+_local = threading.local()
+_stats_lock = threading.Lock()
+_stats = {'renders': 0, 'total_time': 0.0, 'max_time': 0.0, 'slow': 0}
+
+
+def _renderers():
+    '''当前线程的 (Markdown, Cleaner, Linker) 对象'''
+    renderers = getattr(_local, 'renderers', None)
+    if renderers is None:
+        renderers = _local.renderers = (
+                Markdown(output_format='html',
+                        extensions=MARKDOWN_EXTENSIONS),
+                # strip=True 表示直接去掉不允许的标签，而不是转义
+                Cleaner(tags=ALLOWED_TAGS, strip=True),
+                Linker())
+    return renderers
+
+
+def render_key(body):
+    '''正文在缓存中的 key'''
+    return hashlib.sha1((CONFIG_HASH + body).encode()).hexdigest()
+
+
+def _render(body):
+    '''不使用缓存，直接转换，返回值是 HTML 字符串'''
+    md, cleaner, linker = _renderers()
+    start = time.perf_counter()
+    # markdown 生成 HTML ，cleaner 清洗 HTML ，linker 把网址转换成 <a> 标签
+    html = linker.linkify(cleaner.clean(md.reset().convert(body)))
+    elapsed = time.perf_counter() - start
+    with _stats_lock:
+        _stats['renders'] += 1
+        _stats['total_time'] += elapsed
+        _stats['max_time'] = max(_stats['max_time'], elapsed)
+        if elapsed >= SLOW_RENDER_SECONDS:
+            _stats['slow'] += 1
+    if elapsed >= SLOW_RENDER_SECONDS:
+        logger.warning('Slow markdown render: %.3fs for %d chars',
+                elapsed, len(body))
+    return html
+
+
+def render_markdown(body):
+    '''把 Markdown 文本转换成安全的 HTML ，优先从缓存中读取'''
+    if not body:
+        return ''
+    key = render_key(body)
+    html = render_cache.get(key)
+    if html is None:
+        html = _render(body)
+        render_cache.set(key, html, RENDER_CACHE_TTL)
+    return html
+
+
+def cached_html(body):
+    '''缓存中与正文对应的 HTML ，没有缓存时返回 None'''
+    return render_cache.get(render_key(body))
+
+
+def render_stats():
+    '''转换次数、耗时和缓存命中情况'''
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['avg_time'] = (stats['total_time'] / stats['renders']
+            if stats['renders'] else 0.0)
+    stats['cache'] = render_cache.stats()
+    return stats
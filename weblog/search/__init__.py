@@ -0,0 +1,13 @@
+'''
+博客全文搜索
+
+写入博客时只把博客 ID 放进本地的持久化队列
+由单独的索引进程从队列中批量取出，一次提交写入搜索索引
+这样多个 gunicorn worker 不会在写博客时争抢 Whoosh 的写锁
+使用 MySQL FULLTEXT 搜索后端时，索引由数据库维护，不需要队列
+'''
+
+from .backends import SearchBackend, get_backend
+from .queue import SearchQueue, get_queue
+from .results import result_cache, search_page
+from .indexer import drain, catch_up
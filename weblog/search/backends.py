@@ -0,0 +1,205 @@
+'''
+搜索后端
+
+SearchBackend 定义了搜索后端的接口，配置项 SEARCH_BACKEND 选择使用哪一个
+whoosh: 本地磁盘上的 Whoosh 索引，由索引进程通过队列更新
+mysql: MySQL 的 FULLTEXT 索引（ngram 分词，支持中文），由数据库自己维护
+'''
+
+from abc import ABC, abstractmethod
+
+import whoosh.index
+import whoosh.qparser
+import whoosh.writing
+from flask import current_app
+
+from ..models import db, whooshee, Blog
+
+
+class SearchBackend(ABC):
+    '''搜索后端的接口
+
+    子类必须实现 search 和 stats ，其他方法有默认实现
+    由数据库自己维护索引的后端不需要覆盖 index 等写入索引的方法
+    '''
+
+    # 为 True 时博客的变化需要经过队列和索引进程写入索引
+    uses_queue = False
+
+    def __init__(self, app):
+        self.app = app
+        self._generation = 0
+
+    @abstractmethod
+    def search(self, text, limit=None):
+        '''搜索博客，返回值是按相关度排序的博客 ID 列表'''
+
+    def search_page(self, text, page, per_page):
+        '''搜索结果的第 page 页，返回值是 (本页博客 ID 列表, 命中总数)'''
+        ids = self.search(text)
+        start = (page - 1) * per_page
+        return ids[start:start + per_page], len(ids)
+
+    def generation(self):
+        '''索引的版本号，索引写入新数据之后改变，用作搜索结果缓存的 key'''
+        return self._generation
+
+    def changed(self):
+        '''索引内容发生了变化'''
+        self._generation += 1
+
+    def index(self, rows, deleted=()):
+        '''把博客写入索引，并从索引中删除 deleted 中的博客 ID
+
+        rows 中的每一项都有 id 和 body 属性
+        '''
+
+    def indexed_ids(self):
+        '''索引中全部博客的 ID 集合'''
+        return set()
+
+    @abstractmethod
+    def stats(self):
+        '''索引的统计信息，返回值是字典'''
+
+    def optimize(self):
+        '''整理索引，提高查询速度'''
+
+
+class WhooshBackend(SearchBackend):
+    '''flask_whooshee 管理的 Whoosh 索引'''
+
+    uses_queue = True
+
+    @property
+    def whoosheer(self):
+        return Blog._whoosheer_
+
+    def open_index(self):
+        return whooshee.get_or_create_index(self.app, self.whoosheer)
+
+    def writer(self):
+        return self.open_index().writer(
+                timeout=self.app.extensions['whooshee']['writer_timeout'])
+
+    def search(self, text, limit=None):
+        return self.whoosheer.search(text, values_of='id', limit=limit)
+
+    def search_page(self, text, page, per_page):
+        # 与 whoosheer.search 相同的查询，只取到本页为止的结果
+        # 命中总数由 Whoosh 从倒排索引中统计，不需要取出全部结果
+        whoosheer = self.whoosheer
+        index = self.open_index()
+        parser = whoosh.qparser.MultifieldParser(whoosheer.schema.names(),
+                index.schema, group=whoosh.qparser.OrGroup)
+        query = parser.parse(whoosheer.prep_search_string(text, True))
+        start = (page - 1) * per_page
+        with index.searcher() as searcher:
+            results = searcher.search(query, limit=start + per_page)
+            return ([hit['id'] for hit in results[start:start + per_page]],
+                    len(results))
+
+    def generation(self):
+        # 索引进程每次提交都会生成新的 TOC 文件，各个 worker 进程都能看到
+        return self.open_index().latest_generation()
+
+    def index(self, rows, deleted=()):
+        # 一批数据只打开一次 writer ，退出 with 语句块时提交一次
+        with self.writer() as writer:
+            for row in rows:
+                self.whoosheer.update_blog(writer, row)
+            for id in deleted:
+                writer.delete_by_term('id', id)
+
+    def indexed_ids(self):
+        with self.open_index().searcher() as searcher:
+            return {fields['id'] for fields in searcher.all_stored_fields()}
+
+    def stats(self):
+        index = self.open_index()
+        storage = index.storage
+        # Whoosh 没有列出段的公开接口，只能用私有方法 _segments
+        # requirements.txt 固定了 Whoosh==2.7.4 ，升级 Whoosh 时要检查这里
+        segments = index._segments()
+        return {
+            'generation': index.latest_generation(),
+            'segments': len(segments),
+            'docs': index.doc_count(),
+            # 已删除但还占着空间的文档，合并段之后才会真正删除
+            'deleted': sum(segment.deleted_count() for segment in segments),
+            'size': sum(storage.file_length(name)
+                    for name in storage.list()),
+        }
+
+    def optimize(self):
+        # 把全部段合并成一个，同时清除已删除的文档
+        self.writer().commit(optimize=True)
+
+    def replace(self, paths):
+        '''用 paths 目录中的子索引替换整个索引
+
+        一次提交完成，搜索进程要么看到旧索引，要么看到新索引
+        '''
+        readers = [whoosh.index.open_dir(path).reader() for path in paths]
+        try:
+            writer = self.writer()
+            for reader in readers:
+                writer.add_reader(reader)
+            # CLEAR 丢弃现有的全部段，只保留本次写入的数据
+            writer.commit(mergetype=whoosh.writing.CLEAR)
+        finally:
+            for reader in readers:
+                reader.close()
+
+
+class MySQLBackend(SearchBackend):
+    '''MySQL 的 FULLTEXT 索引
+
+    需要 blog.body 上的 FULLTEXT 索引（WITH PARSER ngram），由数据库迁移创建
+    索引随数据一起提交，不需要队列和索引进程
+    索引的版本号只在本进程提交博客时改变，其他进程的搜索结果缓存依靠有效期过期
+    '''
+
+    def search(self, text, limit=None):
+        match = 'MATCH (body) AGAINST (:text IN NATURAL LANGUAGE MODE)'
+        sql = 'SELECT id FROM blog WHERE {0} ORDER BY {0} DESC'.format(match)
+        params = {'text': text}
+        if limit:
+            sql += ' LIMIT :limit'
+            params['limit'] = limit
+        return [id for (id,) in db.session.execute(sql, params)]
+
+    def search_page(self, text, page, per_page):
+        match = 'MATCH (body) AGAINST (:text IN NATURAL LANGUAGE MODE)'
+        params = {'text': text, 'limit': per_page,
+                'offset': (page - 1) * per_page}
+        ids = [id for (id,) in db.session.execute('SELECT id FROM blog '
+                'WHERE {0} ORDER BY {0} DESC LIMIT :limit OFFSET :offset'
+                .format(match), params)]
+        total = db.session.execute('SELECT COUNT(*) FROM blog WHERE {}'
+                .format(match), params).scalar()
+        return ids, total
+
+    def stats(self):
+        docs = db.session.execute('SELECT COUNT(*) FROM blog').scalar()
+        return {'docs': docs}
+
+    def optimize(self):
+        # 配合 innodb_optimize_fulltext_only=ON 只整理 FULLTEXT 索引
+        db.session.execute('OPTIMIZE TABLE blog')
+
+
+BACKENDS = {
+    'whoosh': WhooshBackend,
+    'mysql': MySQLBackend,
+}
+
+
+def get_backend(app=None):
+    '''当前应用使用的搜索后端'''
+    app = app or current_app
+    backend = app.extensions.get('search_backend')
+    if backend is None:
+        backend = app.extensions['search_backend'] = \
+                BACKENDS[app.config['SEARCH_BACKEND']](app)
+    return backend
@@ -0,0 +1,178 @@
+'''
+搜索索引进程
+
+从队列中批量取出博客 ID ，交给搜索后端一次写入索引
+启动方式：flask search index
+'''
+
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from multiprocessing import Pool
+import whoosh.index
+from flask import current_app
+
+from ..cache import commit_hook, mark_dirty
+from ..models import db, Blog
+from .backends import get_backend
+from .queue import get_queue
+
+
+# 队列状态中时间的格式
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def index_blogs(app, ids):
+    '''把 ids 中的博客写入索引，已删除的博客从索引中删除'''
+    table = Blog.__table__
+    # 使用 Core 查询，不占用 db.session ，也可以在事务提交之后的钩子中调用
+    with db.get_engine(app).connect() as conn:
+        rows = conn.execute(db.select([table.c.id, table.c.body]).where(
+                table.c.id.in_(ids))).fetchall()
+    deleted = set(ids) - {row.id for row in rows}
+    get_backend(app).index(rows, deleted)
+
+
+def drain(app, batch_size=None):
+    '''处理队列中的全部数据，返回写入索引的博客数量'''
+    queue = get_queue(app)
+    batch_size = batch_size or app.config['SEARCH_INDEX_BATCH_SIZE']
+    count = 0
+    while True:
+        rows = queue.peek(batch_size)
+        if not rows:
+            break
+        # 同一篇博客在一个批次中多次出现时只写一次
+        ids = sorted({blog_id for _, blog_id in rows})
+        started_at = datetime.now()
+        index_blogs(app, ids)
+        queue.ack(rows[-1][0])
+        queue.set_meta('last_indexed_at', started_at.strftime(TIME_FORMAT))
+        count += len(ids)
+    return count
+
+
+def run(app, interval=1.0, batch_size=None, once=False, echo=print):
+    '''索引进程的主循环，队列为空时每隔 interval 秒检查一次
+
+    每隔 SEARCH_OPTIMIZE_INTERVAL 秒合并一次索引的段
+    '''
+    optimize_interval = app.config['SEARCH_OPTIMIZE_INTERVAL']
+    optimized_at = time.monotonic()
+    while True:
+        count = drain(app, batch_size)
+        if count:
+            echo('Indexed {} blogs.'.format(count))
+        if once:
+            return
+        if (optimize_interval and
+                time.monotonic() - optimized_at >= optimize_interval):
+            get_backend(app).optimize()
+            optimized_at = time.monotonic()
+            echo('Optimized the search index.')
+        time.sleep(interval)
+
+
+def _build_part(args):
+    '''在进程池的子进程中把一批博客写入 path 目录中的子索引'''
+    path, rows = args
+    index = whoosh.index.create_in(path, Blog._whoosheer_.schema)
+    writer = index.writer()
+    for id, body in rows:
+        writer.add_document(id=id, body=body)
+    writer.commit()
+    return path, len(rows)
+
+
+def rebuild(app, processes=None, chunk_size=5000, echo=print):
+    '''根据 blog 数据表重建整个 Whoosh 索引，返回写入索引的博客数量
+
+    主进程按 ID 分批读取博客，进程池中的子进程各自把一批博客写入一个子索引
+    全部完成后一次提交，用子索引替换现有的索引
+    重建期间修改过的博客由 catch_up 重新放进队列
+    '''
+    backend = get_backend(app)
+    started_at = datetime.now()
+    table = Blog.__table__
+    # 子索引与索引放在同一个文件系统上
+    workdir = tempfile.mkdtemp(prefix='rebuild-',
+            dir=app.extensions['whooshee']['index_path_root'])
+    try:
+        def chunks():
+            last_id = 0
+            number = 0
+            while True:
+                with db.get_engine(app).connect() as conn:
+                    rows = conn.execute(db.select([table.c.id, table.c.body]
+                            ).where(table.c.id > last_id).order_by(
+                            table.c.id).limit(chunk_size)).fetchall()
+                if not rows:
+                    return
+                last_id = rows[-1][0]
+                number += 1
+                path = os.path.join(workdir, str(number))
+                os.mkdir(path)
+                yield path, [tuple(row) for row in rows]
+
+        paths = []
+        count = 0
+        with Pool(processes) as pool:
+            for path, size in pool.imap_unordered(_build_part, chunks()):
+                paths.append(path)
+                count += size
+                echo('Indexed {} blogs...'.format(count))
+        backend.replace(sorted(paths, key=lambda path: int(os.path.basename(path))))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    catch_up(app, since=started_at)
+    return count
+
+
+def catch_up(app, since=None):
+    '''把索引进程停止期间漏掉的博客放进队列，返回入队的数量
+
+    since 之后修改过的博客重新索引，默认为最近一次写入索引的时间
+    已经不在数据库中的博客从索引中删除
+    '''
+    queue = get_queue(app)
+    if since is None:
+        last = queue.get_meta('last_indexed_at')
+        since = datetime.strptime(last, TIME_FORMAT) if last else \
+                datetime.min
+    table = Blog.__table__
+    with db.get_engine(app).connect() as conn:
+        changed = [id for (id,) in conn.execute(db.select([table.c.id]
+                ).where(table.c.updated_at >= since))]
+        existing = {id for (id,) in conn.execute(db.select([table.c.id]))}
+    indexed = get_backend(app).indexed_ids()
+    ids = sorted(set(changed) | (indexed - existing))
+    if ids:
+        queue.push(ids)
+    return len(ids)
+
+
+def _on_blog_change(mapper, connection, target):
+    mark_dirty(target, 'search_index', target.id)
+
+
+@commit_hook('search_index')
+def _enqueue(ids):
+    # 博客数据提交之后才放进队列，索引进程读到的一定是已提交的数据
+    app = current_app._get_current_object()
+    backend = get_backend(app)
+    if not backend.uses_queue:
+        backend.changed()
+        return
+    get_queue(app).push(sorted(ids))
+    if app.config['SEARCH_INDEX_SYNC']:
+        # 开发和测试时可以不运行索引进程，直接在当前进程中写入索引
+        drain(app)
+
+
+# 博客的索引改由队列和索引进程更新，关闭 flask_whooshee 在提交时的同步更新
+Blog._whoosheer_.auto_update = False
+db.event.listen(Blog, 'after_insert', _on_blog_change)
+db.event.listen(Blog, 'after_update', _on_blog_change)
+db.event.listen(Blog, 'after_delete', _on_blog_change)
@@ -0,0 +1,93 @@
+'''
+搜索索引的持久化队列
+
+队列是一个 SQLite 数据库文件，默认与 Whoosh 索引放在同一目录
+同一台机器上的多个 worker 进程都可以写入，由索引进程读取
+队列中只记录需要更新索引的博客 ID ，索引进程根据博客是否存在决定更新或删除
+'''
+
+import os
+import sqlite3
+import time
+from threading import Lock
+from flask import current_app
+
+
+
+class SearchQueue:
+    '''搜索索引队列'''
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS queue ('
+                    'seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                    'blog_id INTEGER NOT NULL, '
+                    'enqueued_at REAL NOT NULL)')
+            # 保存索引进程的状态，例如最近一次写入索引的时间
+            conn.execute('CREATE TABLE IF NOT EXISTS meta ('
+                    'key TEXT PRIMARY KEY, value TEXT)')
+
+    def _connect(self):
+        # 多个进程同时读写，使用 WAL 模式并等待锁释放
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def push(self, ids):
+        '''把需要更新索引的博客 ID 放进队列'''
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany('INSERT INTO queue (blog_id, enqueued_at) '
+                    'VALUES (?, ?)', [(id, now) for id in ids])
+
+    def peek(self, limit):
+        '''按入队顺序读取最多 limit 条数据，返回值是 (序号, 博客 ID) 列表'''
+        with self._connect() as conn:
+            return conn.execute('SELECT seq, blog_id FROM queue '
+                    'ORDER BY seq LIMIT ?', (limit,)).fetchall()
+
+    def ack(self, max_seq):
+        '''删除序号不大于 max_seq 的数据，即已经写入索引的数据'''
+        with self._connect() as conn:
+            conn.execute('DELETE FROM queue WHERE seq <= ?', (max_seq,))
+
+    def get_meta(self, key, default=None):
+        with self._connect() as conn:
+            row = conn.execute('SELECT value FROM meta WHERE key = ?',
+                    (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO meta (key, value) '
+                    'VALUES (?, ?)', (key, str(value)))
+
+    def lag(self):
+        '''索引延迟：队列中等待的数量，以及最早一条等待了多少秒'''
+        with self._connect() as conn:
+            pending, oldest = conn.execute('SELECT COUNT(*), '
+                    'MIN(enqueued_at) FROM queue').fetchone()
+        return {
+            'pending': pending,
+            'lag_seconds': time.time() - oldest if oldest else 0.0,
+            'last_indexed_at': self.get_meta('last_indexed_at')
+        }
+
+
+_queue_lock = Lock()
+
+
+def get_queue(app=None):
+    '''当前应用的搜索索引队列，首次使用时创建'''
+    app = app or current_app
+    with _queue_lock:
+        queue = app.extensions.get('search_queue')
+        if queue is None:
+            path = app.config['SEARCH_QUEUE_PATH'] or os.path.join(
+                    app.extensions['whooshee']['index_path_root'],
+                    'queue.sqlite')
+            queue = app.extensions['search_queue'] = SearchQueue(path)
+    return queue
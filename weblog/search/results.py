@@ -0,0 +1,34 @@
+'''
+搜索结果缓存
+
+同一个搜索词翻页时，每一页都要重新执行一次搜索
+这里把搜索结果前面一段按相关度排好序的博客 ID 和命中总数缓存起来
+在缓存范围内翻页只需要切片，不再查询索引
+缓存的 key 中带有索引的版本号，索引写入新数据之后旧的缓存自然失效
+'''
+
+from flask import current_app
+
+from ..cache import TTLCache
+from .backends import get_backend
+
+
+# 键为 (搜索词, 索引版本号)，值为 (博客 ID 列表, 命中总数) 元组
+result_cache = TTLCache(maxsize=256)
+
+
+def search_page(text, page, per_page, app=None):
+    '''搜索结果的第 page 页，返回值是 (本页博客 ID 列表, 命中总数)'''
+    app = app or current_app
+    backend = get_backend(app)
+    key = (text, backend.generation())
+    cached = result_cache.get(key)
+    if cached is None:
+        cached = backend.search_page(text, 1, app.config['SEARCH_CACHE_RESULTS'])
+        result_cache.set(key, cached, app.config['SEARCH_CACHE_TTL'])
+    ids, total = cached
+    start = (page - 1) * per_page
+    if start + per_page <= len(ids) or len(ids) == total:
+        return ids[start:start + per_page], total
+    # 超出缓存范围的深页直接交给搜索引擎分页
+    return backend.search_page(text, page, per_page)
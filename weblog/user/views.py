@@ -6,7 +6,8 @@ from . import user
 from .forms import ProfileForm, ChangePasswordForm, ChangeEmailForm
 from .forms import BeforeResetPasswordForm, ResetPasswordForm
 from ..main.forms import BlogForm
-from ..models import db, User, Role, Blog, Permission
+from ..models import db, User, Role, Blog, Follow, Permission
+from ..pagination import paginate
 from ..email import send_email
 
 
@@ -39,7 +40,10 @@ def index(name):
     user = User.query.filter_by(name=name).first()
     if not user:
         abort(404)
-    blogs = user.blogs.order_by(Blog.time_stamp.desc())
+    # 博客的作者就是 user ，ORM 会从 Session 的 identity map 中直接取得
+    # 这里仍然使用 joinedload ，保证不会为每篇博客单独查询作者
+    blogs = user.blogs.options(db.joinedload(Blog.author)).order_by(
+            Blog.time_stamp.desc())
     return render_template('user/index.html', user=user, blogs=blogs,
             Permission=Permission)
 
@@ -193,12 +197,11 @@ def followed(name):
     if not user:
         flash('用户不存在。', 'warning')
         return redirect(url_for('user.index'))
-    page = request.args.get('page', default=1, type=int)
-    pagination = user.followed.paginate(
-            page,
-            per_page = current_app.config['USERS_PER_PAGE'],
-            error_out = False
-    )
+    # 默认使用页码分页，URL 中带有 cursor 参数时使用游标分页
+    # Follow.followed 和 Follow.follower 是 lazy='joined' ，用户已经一起加载
+    pagination = paginate(user.followed,
+            (Follow.time_stamp, Follow.followed_id),
+            current_app.config['USERS_PER_PAGE'], cursor=False)
     follows = [{'user': f.followed, 'time_stamp': f.time_stamp}
             for f in pagination.items]
     # 这个模板是「关注了哪些用户」和「被哪些用户关注了」共用的模板
@@ -213,12 +216,9 @@ def followers(name):
     if not user:
         flash('用户不存在。', 'warning')
         return redirect(url_for('user.index'))
-    page = request.args.get('page', default=1, type=int)
-    pagination = user.followers.paginate(
-            page,
-            per_page = current_app.config['USERS_PER_PAGE'],
-            error_out = False
-    )
+    pagination = paginate(user.followers,
+            (Follow.time_stamp, Follow.follower_id),
+            current_app.config['USERS_PER_PAGE'], cursor=False)
     follows = [{'user': f.follower, 'time_stamp': f.time_stamp}
             for f in pagination.items]
     return render_template('user/follow.html', user=user, title='关注我的人',